@@ -1,59 +1,163 @@
-# 列表推导
-symbols = '$%^&*'
-codes = [ord(symbol) for symbol in symbols]
-print(codes)
+if __name__ == '__main__':
+    # 列表推导
+    symbols = '$%^&*'
+    codes = [ord(symbol) for symbol in symbols]
+    print(codes)
 
 
-# 使用map&filter也可以做到列表推导的效果，但可读性会差很多，且速度不一定快
-symbols = '$%^&*'
-codes = [ord(symbol) for symbol in symbols if ord(symbol) > 127]
-print(codes)
-codes = list(filter(lambda c: c > 127, map(ord, symbols)))
-print(codes)
+    # 使用map&filter也可以做到列表推导的效果，但可读性会差很多，且速度不一定快
+    symbols = '$%^&*'
+    codes = [ord(symbol) for symbol in symbols if ord(symbol) > 127]
+    print(codes)
+    codes = list(filter(lambda c: c > 127, map(ord, symbols)))
+    print(codes)
 
 
-# python2中，列表推导中for关键词之后的赋值操作可能会影响列表推导上下文的同名对量
-# eg.
-# x = '123'
-# dummy = [x for x in 'ABC]
-# x >>> 'C'
+    # python2中，列表推导中for关键词之后的赋值操作可能会影响列表推导上下文的同名对量
+    # eg.
+    # x = '123'
+    # dummy = [x for x in 'ABC]
+    # x >>> 'C'
 
-# python3则不会出现上述情况，表达式内部的变量只在局部起作用
+    # python3则不会出现上述情况，表达式内部的变量只在局部起作用
 
 
-# 列表推导笛卡尔积
-colors = ['black', 'white']
-sizes = ['S', 'M', 'L']
-# tshirts = [(color, size) for size in sizes for color in colors]  顺序看谁在前面
-tshirts = [(color, size) for color in colors for size in sizes]
-print(tshirts)
+    # 列表推导笛卡尔积
+    colors = ['black', 'white']
+    sizes = ['S', 'M', 'L']
+    # tshirts = [(color, size) for size in sizes for color in colors]  顺序看谁在前面
+    tshirts = [(color, size) for color in colors for size in sizes]
+    print(tshirts)
 
 
-# 生成器表达式是更好的选择
-# 生成器表达式背后遵守了迭代器的协议，可以逐个地产出元素，而不是先建立一个完整的列表，
-# 然后再把这个列表传递到某个构造函数里。生成器表达式显然可以节省内存
-colors = ['black', 'white']
-sizes = ['S', 'M', 'L']
-for tshirt in ('%s %s' % (c, s) for c in colors for s in sizes):
-    print(tshirt)
+    # 生成器表达式是更好的选择
+    # 生成器表达式背后遵守了迭代器的协议，可以逐个地产出元素，而不是先建立一个完整的列表，
+    # 然后再把这个列表传递到某个构造函数里。生成器表达式显然可以节省内存
+    colors = ['black', 'white']
+    sizes = ['S', 'M', 'L']
+    for tshirt in ('%s %s' % (c, s) for c in colors for s in sizes):
+        print(tshirt)
 
-# 不使用中间变量交换两个变量的值
-a = 1
-b = 2
-a, b = b, a
-print(a, b)
+# 维度很多时笛卡尔积有上亿个元素，列表推导会把内存撑爆，生成器表达式又只能从头顺序产出
+# LazyProduct对N个维度做惰性笛卡尔积，顺序与嵌套for（最后一个维度变化最快）一致
+# where在组合之前先按维度过滤，被过滤掉的值不会参与组合
+# 第i个组合可以用混合进制直接算出来，不需要枚举前面的组合，所以能把整个空间切成若干片分给不同的worker
+import itertools
 
-# 运用*运算符可以把一个可迭代对象拆开作为函数的参数
-print(divmod(20, 8))
-t = (20, 8)
-print(divmod(*t))
+class LazyProduct:
+    def __init__(self, *dimensions):
+        self.dimensions = [tuple(d) for d in dimensions]
 
-# 可以用*来处理剩下的元素
-# 但在平行赋值中， *前缀只能用在一个变量名前面，但是这个变量名可以出现在赋值表达式的任意位置
-a, b, *rest = range(5)
-print(a, b, rest)
-*rest, b, c, d = range(5)
-print(rest, b, c, d)
+    def __len__(self):
+        n = 1
+        for d in self.dimensions:
+            n *= len(d)
+        return n
+
+    def __iter__(self):
+        return itertools.product(*self.dimensions)
+
+    # 返回只保留维度axis中满足predicate的值的新LazyProduct
+    def where(self, axis, predicate):
+        dims = list(self.dimensions)
+        dims[axis] = [v for v in dims[axis] if predicate(v)]
+        return LazyProduct(*dims)
+
+    # 把下标按混合进制拆成每个维度上的下标
+    def _digits(self, index):
+        digits = []
+        for d in reversed(self.dimensions):
+            index, digit = divmod(index, len(d))
+            digits.append(digit)
+        return digits[::-1]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('LazyProduct index out of range')
+        return tuple(d[i] for d, i in zip(self.dimensions, self._digits(index)))
+
+    # 产出下标在[start, stop)之间的组合，只在起点做一次混合进制解码
+    # 从起点开始的剩余部分可以拆成若干段product：最后一维剩下的值，
+    # 倒数第二维剩下的值乘上最后一维的全部值……每一段都交给itertools.product在C里产出
+    def islice(self, start, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return iter(())
+        digits = self._digits(start)
+        dims = self.dimensions
+        last = len(dims) - 1
+        segments = (itertools.product(*[(d[i],) for d, i in zip(dims[:k], digits[:k])],
+                                      dims[k][digits[k] + (k != last):], *dims[k + 1:])
+                    for k in range(last, -1, -1))
+        return itertools.islice(itertools.chain.from_iterable(segments), stop - start)
+
+    # 第k片（共n片）的组合，各片大小最多相差1
+    def shard(self, k, n):
+        size, extra = divmod(len(self), n)
+        start = k * size + min(k, extra)
+        return self.islice(start, start + size + (k < extra))
+
+    # 每次产出一个包含size个组合的列表
+    def batches(self, size):
+        it = iter(self)
+        while True:
+            batch = list(itertools.islice(it, size))
+            if not batch:
+                return
+            yield batch
+
+if __name__ == '__main__':
+    skus = LazyProduct(colors, sizes)
+    print(len(skus), skus[4], list(skus.shard(1, 2)), list(skus.where(1, lambda s: s != 'M')))
+
+# 比较列表推导、生成器表达式和LazyProduct的峰值内存与吞吐量，dims固定为4个维度
+def bench_lazy_product(dims=(['c%d' % i for i in range(100)], ['s%d' % i for i in range(100)],
+                             ['m%d' % i for i in range(10)], ['w%d' % i for i in range(20)])):
+    import time
+    import tracemalloc
+
+    def consume(iterable):
+        n = 0
+        for item in iterable:
+            n += 1
+        return n
+
+    cases = [
+        ('list comp', lambda: [(a, b, c, d) for a in dims[0] for b in dims[1] for c in dims[2] for d in dims[3]]),
+        ('genexp', lambda: ((a, b, c, d) for a in dims[0] for b in dims[1] for c in dims[2] for d in dims[3])),
+        ('LazyProduct', lambda: LazyProduct(*dims)),
+        ('LazyProduct batches', lambda: (item for batch in LazyProduct(*dims).batches(10000) for item in batch)),
+    ]
+    for name, make in cases:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        n = consume(make())
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-20s %10.0f items/s  peak %10d bytes' % (name, n / elapsed, peak))
+# bench_lazy_product()
+
+if __name__ == '__main__':
+    # 不使用中间变量交换两个变量的值
+    a = 1
+    b = 2
+    a, b = b, a
+    print(a, b)
+
+    # 运用*运算符可以把一个可迭代对象拆开作为函数的参数
+    print(divmod(20, 8))
+    t = (20, 8)
+    print(divmod(*t))
+
+    # 可以用*来处理剩下的元素
+    # 但在平行赋值中， *前缀只能用在一个变量名前面，但是这个变量名可以出现在赋值表达式的任意位置
+    a, b, *rest = range(5)
+    print(a, b, rest)
+    *rest, b, c, d = range(5)
+    print(rest, b, c, d)
 
 
 # namedtuple是一个工厂函数，用来创建一个带字段名的元素和一个有名字的类
@@ -61,59 +165,187 @@ from collections import namedtuple
 # 需要两个参数，一个是类名，另一个是类的各个字段的名字。后者可以是由数个字符串组成的可迭代对象，
 # 或者是由空格分隔开的字段名组成的字符串
 City = namedtuple('City', 'name country population coordinates')
-tokyo = City('Tokyo', 'JP', '36.933', (35.689722, 139.691667))
-print(tokyo.name, tokyo.coordinates)
+if __name__ == '__main__':
+    tokyo = City('Tokyo', 'JP', '36.933', (35.689722, 139.691667))
+    print(tokyo.name, tokyo.coordinates)
 
-# 除了从普通元祖那里继承来的属性之外，namedtuple还有一些自己专有的属性
-# 这个类所有字段名称的元组
-print(City._fields)
+    # 除了从普通元祖那里继承来的属性之外，namedtuple还有一些自己专有的属性
+    # 这个类所有字段名称的元组
+    print(City._fields)
 LatLong = namedtuple('LatLong', 'lat long')
-delhi_data = ('Delhi NCR', 'IN', 21.935, LatLong(28.613889, 77.208889))
-# 接受一个可迭代对象生成一个这个类的实例，效果与City(*delhi_data)一样
-delhi = City._make(delhi_data)
-# 把namedtuple以collections.OrderedDict的形式返回
-for key, value in delhi._asdict().items():
-    print(key + ':', value)
-
-
-# s[a:b:c]即在a和b之间以c为间隔取值，c的值可以为负，意味着反向取值
-s = 'bicycle'
-print(s[::3])
-print(s[::-1])
-print(s[::-2])
-
-# 省略 ...
-# 如果x是四维数组，那么x[i, ...]就是x[i, :, :, :]的缩写
-
-# 给切片赋值
-l = list(range(10))
-l[2: 5] = [20, 30]
-print(l)
-del l[5: 7]
-print(l)
-l[3::2] = [11, 22]
-print(l)
-# 即使只有一个值，右边也必须是可迭代对象
-l[2::5] = [100]
-
-
-# 若序列a里的元素是对其他可变对象的引用的话，所得结果不是你所想的
-# 如my_list = [[]] * 3 来初始化一个由列表组成的列表，但所得到的列表里包含的三个元素是三个引用
-# 且这个三个引用指向的都是同一个列表
-# 正确方法如下
-board = [['_'] * 3 for i in range(3)]
-# 错误方法 [['_'] * 3] * 3
-
-
-# 对于可变序列，*=不改变序列id，不可变序列则反之
-l = [1, 2, 3]
-print(id(l))
-l *= 2
-print(id(l))
-t = (1, 2, 3)
-print(id(t))
-t *= 2
-print(id(t))
+if __name__ == '__main__':
+    delhi_data = ('Delhi NCR', 'IN', 21.935, LatLong(28.613889, 77.208889))
+    # 接受一个可迭代对象生成一个这个类的实例，效果与City(*delhi_data)一样
+    delhi = City._make(delhi_data)
+    # 把namedtuple以collections.OrderedDict的形式返回
+    for key, value in delhi._asdict().items():
+        print(key + ':', value)
+
+# 几千万个City时，每个都是一个元组加一个嵌套的LatLong元组，再加上装箱的float对象
+# CityTable按列存储：name和country放在列表里并用sys.intern驻留，重复的国家代码只存一份
+# population、lat、long放在array('d')里，不再有float对象
+# 取出的行是轻量的CityRow代理，只记录表和行号，支持_fields、_make和_asdict
+# population统一存为float
+import sys
+import array
+
+class CityTable:
+    _fields = City._fields
+
+    def __init__(self, cities=()):
+        self.names = []
+        self.countries = []
+        self.populations = array.array('d')
+        self.lats = array.array('d')
+        self.longs = array.array('d')
+        self.extend(cities)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('CityTable index out of range')
+        return CityRow(self, index)
+
+    def __iter__(self):
+        return (CityRow(self, i) for i in range(len(self)))
+
+    def append(self, city):
+        name, country, population, (lat, long) = city
+        self.names.append(sys.intern(name))
+        self.countries.append(sys.intern(country))
+        self.populations.append(float(population))
+        self.lats.append(lat)
+        self.longs.append(long)
+        return CityRow(self, len(self) - 1)
+
+    def extend(self, cities):
+        for city in cities:
+            self.append(city)
+
+class CityRow:
+    __slots__ = ('_table', '_index')
+    _fields = City._fields
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def name(self):
+        return self._table.names[self._index]
+
+    @property
+    def country(self):
+        return self._table.countries[self._index]
+
+    @property
+    def population(self):
+        return self._table.populations[self._index]
+
+    @property
+    def coordinates(self):
+        return LatLong(self._table.lats[self._index], self._table.longs[self._index])
+
+    def __iter__(self):
+        return iter((self.name, self.country, self.population, self.coordinates))
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, (tuple, CityRow)):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return 'City(%s)' % ', '.join('%s=%r' % pair for pair in zip(self._fields, self))
+
+    # 与namedtuple一样，_make是类方法，这里返回一个独立的City
+    @classmethod
+    def _make(cls, iterable):
+        return City._make(iterable)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+if __name__ == '__main__':
+    city_table = CityTable([tokyo, delhi])
+    print(city_table[1], city_table[1].coordinates.lat)
+    for key, value in city_table[1]._asdict().items():
+        print(key + ':', value)
+
+# 比较n个City namedtuple和CityTable的内存占用以及遍历速度
+def bench_city_table(n=10**6):
+    import timeit
+    import tracemalloc
+
+    def gen_cities():
+        countries = ['JP', 'IN', 'CN', 'US', 'BR']
+        return (City('city%d' % (i % 1000), countries[i % 5], i * 0.5, LatLong(i * 1e-5, -i * 1e-5))
+                for i in range(n))
+
+    tracemalloc.start()
+    city_list = list(gen_cities())
+    tuple_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    table = CityTable(gen_cities())
+    table_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('namedtuple : %6.1f bytes/city' % (tuple_bytes / n))
+    print('CityTable  : %6.1f bytes/city' % (table_bytes / n))
+    print('iter namedtuple :', timeit.timeit(lambda: sum(c.coordinates.lat for c in city_list), number=1))
+    print('iter CityRow    :', timeit.timeit(lambda: sum(c.coordinates.lat for c in table), number=1))
+    print('column scan     :', timeit.timeit(lambda: sum(table.lats), number=1))
+# bench_city_table()
+
+
+if __name__ == '__main__':
+    # s[a:b:c]即在a和b之间以c为间隔取值，c的值可以为负，意味着反向取值
+    s = 'bicycle'
+    print(s[::3])
+    print(s[::-1])
+    print(s[::-2])
+
+    # 省略 ...
+    # 如果x是四维数组，那么x[i, ...]就是x[i, :, :, :]的缩写
+
+    # 给切片赋值
+    l = list(range(10))
+    l[2: 5] = [20, 30]
+    print(l)
+    del l[5: 7]
+    print(l)
+    l[3::2] = [11, 22]
+    print(l)
+    # 即使只有一个值，右边也必须是可迭代对象
+    l[2::5] = [100]
+
+
+    # 若序列a里的元素是对其他可变对象的引用的话，所得结果不是你所想的
+    # 如my_list = [[]] * 3 来初始化一个由列表组成的列表，但所得到的列表里包含的三个元素是三个引用
+    # 且这个三个引用指向的都是同一个列表
+    # 正确方法如下
+    board = [['_'] * 3 for i in range(3)]
+    # 错误方法 [['_'] * 3] * 3
+
+
+    # 对于可变序列，*=不改变序列id，不可变序列则反之
+    l = [1, 2, 3]
+    print(id(l))
+    l *= 2
+    print(id(l))
+    t = (1, 2, 3)
+    print(id(t))
+    t *= 2
+    print(id(t))
 
 # t = (1, 2, [30, 40])
 # t[2] += [50, 60]
@@ -133,18 +365,310 @@ import bisect
 def grade(score, breakpoints=[60, 70, 80, 90], grades='FDCBA'):
     i = bisect.bisect(breakpoints, score)
     return grades[i]
-print([grade(score) for score in [33, 99, 77, 70, 89, 90, 100]])
+if __name__ == '__main__':
+    print([grade(score) for score in [33, 99, 77, 70, 89, 90, 100]])
+
+# 分数有上百万个时，每个分数都要调用一次grade和bisect，解释器的开销很大
+# grade_many一次处理一整批分数，接受array.array、memoryview或numpy数组
+# 返回array('B')，每个元素是对应分数在grades中的下标（grade code）
+# 整数分数且范围不大时，先建好一张查找表，之后每个分数只需查一次表
+# 其他情况（浮点数、范围太大）则用map批量做二分查找，不再为每个分数调用一次Python函数
+# numpy只在调用方已经导入时才检查：没导入numpy就不可能传入ndarray，所以导入本模块时不必加载numpy
+import array
+import itertools
+
+INT_TYPECODES = tuple('bBhHiIlLqQ')
+
+def grade_many(scores, breakpoints=(60, 70, 80, 90), grades='FDCBA', max_table_size=1 << 16):
+    if len(grades) != len(breakpoints) + 1:
+        raise ValueError('grades must have one more item than breakpoints')
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(scores, numpy.ndarray):
+        codes = numpy.searchsorted(breakpoints, scores, side='right')
+        return array.array('B', codes.astype(numpy.uint8).tobytes())
+    if isinstance(scores, memoryview):
+        typecode = scores.format
+    else:
+        typecode = getattr(scores, 'typecode', None)
+    if typecode == 'B':
+        # 0~255的分数可以把查找表交给bytes.translate，整批都在C代码里完成
+        table = bytes(bisect.bisect(breakpoints, s) for s in range(256))
+        return array.array('B', bytes(scores).translate(table))
+    if typecode in INT_TYPECODES and len(scores):
+        lo, hi = min(scores), max(scores)
+        if lo >= 0 and hi < max_table_size:
+            table = [bisect.bisect(breakpoints, s) for s in range(hi + 1)]
+            return array.array('B', map(table.__getitem__, scores))
+        if hi - lo < max_table_size:
+            table = [bisect.bisect(breakpoints, s) for s in range(lo, hi + 1)]
+            return array.array('B', [table[s - lo] for s in scores])
+    # 浮点数或范围太大的整数：breakpoints转成与分数相同的类型，避免int与float混合比较
+    # 再用map把整批分数交给bisect，循环和二分查找都在C代码里完成
+    if typecode in ('f', 'd'):
+        breakpoints = [float(b) for b in breakpoints]
+    return array.array('B', map(bisect.bisect, itertools.repeat(breakpoints), scores))
+
+# grade code转换回成绩
+def grade_codes_to_str(codes, grades='FDCBA'):
+    return bytes(codes).translate(bytes(grades.ljust(256), 'ascii')).decode('ascii')
+
+if __name__ == '__main__':
+    print(grade_codes_to_str(grade_many(array.array('B', [33, 99, 77, 70, 89, 90, 100]))))
+
+# 与逐个调用grade的列表推导比较速度
+def bench_grade_many(n=10**6):
+    import random
+    import timeit
+    scores = array.array('B', (random.randrange(101) for i in range(n)))
+    floats = array.array('d', scores)
+    print('list comp :', timeit.timeit(lambda: [grade(s) for s in scores], number=1))
+    print('uint8     :', timeit.timeit(lambda: grade_many(scores), number=1))
+    print('float     :', timeit.timeit(lambda: grade_many(floats), number=1))
+    try:
+        import numpy
+    except ImportError:
+        return
+    np_scores = numpy.frombuffer(scores, dtype=numpy.uint8)
+    print('numpy     :', timeit.timeit(lambda: grade_many(np_scores), number=1))
+# bench_grade_many()
+
+if __name__ == '__main__':
+    # bisect.insort插入新元素
+    import random
+    SIZE = 7
+    random.seed(1729)
+
+    my_list = []
+    for i in range(SIZE):
+        new_item = random.randrange(SIZE * 2)
+        bisect.insort(my_list, new_item)
+        print('%2d ->' % new_item, my_list)
+
+# insort每次插入都要移动插入点之后的所有元素，是O(n)的，元素上千万时就太慢了
+# SortedList把元素分成许多有序的小块（每块约load个元素），_maxes记录每块的最大值
+# 先对_maxes二分找到所在块，再在块内insort，块太大就一分为二
+# 块内移动的元素最多2*load个，插入和删除都接近O(log n)
+# 按下标访问（select）和求排名（rank）用一棵记录各块长度的树状数组，需要时才重建
+class SortedList:
+    def __init__(self, iterable=(), load=1000):
+        self._load = load
+        self._lists = []
+        self._maxes = []
+        self._index = None
+        values = sorted(iterable)
+        for i in range(0, len(values), load):
+            chunk = values[i:i + load]
+            self._lists.append(chunk)
+            self._maxes.append(chunk[-1])
+        self._len = len(values)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._lists)
+
+    def __repr__(self):
+        return 'SortedList(%r)' % list(self)
+
+    def __contains__(self, value):
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return False
+        chunk = self._lists[pos]
+        return chunk[bisect.bisect_left(chunk, value)] == value
+
+    # 与bisect.insort一样，相等的元素插入到已有元素的后面
+    def add(self, value):
+        if not self._maxes:
+            self._lists.append([value])
+            self._maxes.append(value)
+            self._index = None
+        else:
+            pos = bisect.bisect_right(self._maxes, value)
+            if pos == len(self._maxes):
+                pos -= 1
+                self._lists[pos].append(value)
+                self._maxes[pos] = value
+            else:
+                bisect.insort(self._lists[pos], value)
+            self._update_index(pos, 1)
+            self._split(pos)
+        self._len += 1
+
+    def remove(self, value):
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos < len(self._maxes):
+            chunk = self._lists[pos]
+            idx = bisect.bisect_left(chunk, value)
+            if chunk[idx] == value:
+                self._delete(pos, idx)
+                return
+        raise ValueError('%r not in list' % (value,))
+
+    def discard(self, value):
+        try:
+            self.remove(value)
+        except ValueError:
+            pass
+
+    def pop(self, index=-1):
+        pos, idx = self._pos(index)
+        value = self._lists[pos][idx]
+        self._delete(pos, idx)
+        return value
+
+    def bisect_left(self, value):
+        pos = bisect.bisect_left(self._maxes, value)
+        if pos == len(self._maxes):
+            return self._len
+        return self._loc(pos, bisect.bisect_left(self._lists[pos], value))
+
+    def bisect_right(self, value):
+        pos = bisect.bisect_right(self._maxes, value)
+        if pos == len(self._maxes):
+            return self._len
+        return self._loc(pos, bisect.bisect_right(self._lists[pos], value))
+
+    bisect = bisect_right
+
+    # 比value小的元素个数
+    rank = bisect_left
+
+    # 排序后的第index个元素
+    def select(self, index):
+        pos, idx = self._pos(index)
+        return self._lists[pos][idx]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step == 1:
+                return list(self.islice(start, stop))
+            return [self.select(i) for i in range(start, stop, step)]
+        return self.select(index)
+
+    def __delitem__(self, index):
+        self.pop(index)
 
-# bisect.insort插入新元素
-import random
-SIZE = 7
-random.seed(1729)
+    # 惰性地产出下标在[start, stop)之间的元素
+    def islice(self, start=0, stop=None):
+        if stop is None or stop > self._len:
+            stop = self._len
+        if start >= stop:
+            return
+        pos, idx = self._pos(start)
+        remaining = stop - start
+        for chunk in itertools.islice(self._lists, pos, None):
+            part = chunk[idx:idx + remaining]
+            yield from part
+            remaining -= len(part)
+            if not remaining:
+                return
+            idx = 0
 
-my_list = []
-for i in range(SIZE):
-    new_item = random.randrange(SIZE * 2)
-    bisect.insort(my_list, new_item)
-    print('%2d ->' % new_item, my_list)
+    # 惰性地产出值在[minimum, maximum]之间的元素
+    def irange(self, minimum, maximum):
+        return self.islice(self.bisect_left(minimum), self.bisect_right(maximum))
+
+    def _split(self, pos):
+        chunk = self._lists[pos]
+        if len(chunk) > 2 * self._load:
+            half = chunk[self._load:]
+            del chunk[self._load:]
+            self._lists.insert(pos + 1, half)
+            self._maxes.insert(pos, chunk[-1])
+            self._index = None
+
+    def _delete(self, pos, idx):
+        chunk = self._lists[pos]
+        del chunk[idx]
+        self._len -= 1
+        if chunk:
+            self._maxes[pos] = chunk[-1]
+            self._update_index(pos, -1)
+        else:
+            del self._lists[pos]
+            del self._maxes[pos]
+            self._index = None
+
+    def _build_index(self):
+        tree = [0] + [len(chunk) for chunk in self._lists]
+        for i in range(1, len(tree)):
+            j = i + (i & -i)
+            if j < len(tree):
+                tree[j] += tree[i]
+        self._index = tree
+
+    def _update_index(self, pos, delta):
+        tree = self._index
+        if tree is None:
+            return
+        i = pos + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    # 第pos块中第idx个元素的全局下标
+    def _loc(self, pos, idx):
+        if self._index is None:
+            self._build_index()
+        tree = self._index
+        while pos:
+            idx += tree[pos]
+            pos -= pos & -pos
+        return idx
+
+    # 全局下标对应的(块号, 块内下标)
+    def _pos(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('SortedList index out of range')
+        if self._index is None:
+            self._build_index()
+        tree = self._index
+        pos = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(tree) and tree[nxt] <= index:
+                pos = nxt
+                index -= tree[nxt]
+            step >>= 1
+        return pos, index
+
+if __name__ == '__main__':
+    random.seed(1729)
+    sl = SortedList()
+    for i in range(SIZE):
+        new_item = random.randrange(SIZE * 2)
+        sl.add(new_item)
+        print('%2d ->' % new_item, list(sl))
+    print(sl.bisect_left(10), sl.bisect_right(10), sl[2:5], list(sl.irange(4, 10)))
+
+# 从10^3到10^7个元素，比较SortedList.add与bisect.insort
+# insort是O(n^2)的，超过list_limit个元素就不再测试
+def bench_sorted_list(sizes=(10**3, 10**4, 10**5, 10**6, 10**7), list_limit=10**6):
+    import random
+    import timeit
+    for n in sizes:
+        values = [random.random() for i in range(n)]
+
+        def use_list():
+            lst = []
+            for v in values:
+                bisect.insort(lst, v)
+
+        def use_sorted_list():
+            sl = SortedList()
+            for v in values:
+                sl.add(v)
+
+        t_list = timeit.timeit(use_list, number=1) if n <= list_limit else float('nan')
+        t_sorted = timeit.timeit(use_sorted_list, number=1)
+        print('%9d  insort: %8.3fs  SortedList: %8.3fs' % (n, t_list, t_sorted))
+# bench_sorted_list()
 
 # 不要过度使用list，针对特定情况选择
 # 如存放1000万个浮点数，数组array会高效的多
@@ -163,28 +687,534 @@ for i in range(SIZE):
 # print(floats2[-1])
 # print(floats == floats2)
 
+# 数据比内存还大时，fromfile一次读入整个文件就不行了
+# FloatStore用mmap把文件映射到内存，切片得到的是不复制数据的memoryview
+# 操作系统只在访问到某一页时才把它读进来，所以打开文件几乎不花时间
+# 追加数据时直接写到文件末尾，下次访问再重新映射；元素个数在打开时取一次文件大小，之后由append维护，索引时不用fstat
+# 映射过的mmap都记下来，重新映射和close时逐个关闭；外面还拿着旧映射的memoryview时关不掉（BufferError），
+# 就留到下一次再关，之前拿到的memoryview依然有效
+import math
+import mmap
+import os
+
+class FloatStore:
+    def __init__(self, path, typecode='d'):
+        self.path = path
+        self.typecode = typecode
+        self.itemsize = array.array(typecode).itemsize
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        self._fp = open(path, mode)
+        self._len = os.fstat(self._fp.fileno()).st_size // self.itemsize
+        self._maps = []
+        self._view = None
+
+    def __len__(self):
+        return self._len
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._unmap()
+        self._fp.close()
+
+    def _unmap(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        still_open = []
+        for mm in self._maps:
+            try:
+                mm.close()
+            except BufferError:
+                still_open.append(mm)
+        self._maps = still_open
+
+    def _mapped(self):
+        if self._view is None or len(self._view) != self._len:
+            if self._len == 0:
+                return memoryview(array.array(self.typecode))
+            self._unmap()
+            mm = mmap.mmap(self._fp.fileno(), self._len * self.itemsize, access=mmap.ACCESS_READ)
+            self._maps.append(mm)
+            self._view = memoryview(mm).cast(self.typecode)
+        return self._view
+
+    # 追加一批数据，values可以是同类型的array或任意可迭代对象
+    def append(self, values):
+        if not (isinstance(values, array.array) and values.typecode == self.typecode):
+            values = array.array(self.typecode, values)
+        self._fp.seek(0, os.SEEK_END)
+        values.tofile(self._fp)
+        self._fp.flush()
+        self._len += len(values)
+
+    def __getitem__(self, index):
+        return self._mapped()[index]
+
+    def view(self, start=0, stop=None):
+        return self._mapped()[start:stop]
+
+    # 按块产出memoryview，每块chunk_size个元素
+    def chunks(self, chunk_size=1 << 20, start=0, stop=None):
+        view = self._mapped()[start:stop]
+        for i in range(0, len(view), chunk_size):
+            yield view[i:i + chunk_size]
+
+    # 下面的统计都是逐块计算的，不会把整个文件读进内存
+    # sum用math.fsum直接对所有元素求和（先各块sum再fsum没有用，块内的误差已经产生了），mean也基于这个和
+    def sum(self, **kwargs):
+        return math.fsum(itertools.chain.from_iterable(self.chunks(**kwargs)))
+
+    def min(self, **kwargs):
+        return min(min(chunk) for chunk in self.chunks(**kwargs))
+
+    def max(self, **kwargs):
+        return max(max(chunk) for chunk in self.chunks(**kwargs))
+
+    def mean(self, **kwargs):
+        count = sum(map(len, self.chunks(**kwargs)))
+        if count == 0:
+            raise ValueError('mean of an empty FloatStore range')
+        return self.sum(**kwargs) / count
+
+# 比较fromfile整体读入和FloatStore的打开时间以及峰值内存（RSS）
+# ru_maxrss只增不减，所以每种方法都在单独的子进程里测量
+def bench_float_store(n=10**7, path='floats.bin'):
+    import random
+    import subprocess
+    import sys
+    with FloatStore(path) as store:
+        if len(store) < n:
+            for i in range(len(store), n, 10**6):
+                store.append(random.random() for j in range(min(10**6, n - i)))
+    setup = ('import io, resource, sys, time; sys.stdout = io.StringIO(); '
+             'sys.path.insert(0, %r); import chapter2; t0 = time.perf_counter()\n' % os.getcwd())
+    cases = {
+        'fromfile': ("a = chapter2.array.array('d')\n"
+                     "with open(%r, 'rb') as fp: a.fromfile(fp, %d)\n"
+                     "t1 = time.perf_counter(); s = sum(a)\n" % (path, n)),
+        'FloatStore': ("store = chapter2.FloatStore(%r)\n"
+                       "t1 = time.perf_counter(); s = store.sum()\n" % path),
+    }
+    for name, code in cases.items():
+        report = ("sys.stdout = sys.__stdout__; print('%-10s open: %%.4fs  sum: %%.4fs  peak RSS: %%d KB' %% "
+                  "(t1 - t0, time.perf_counter() - t1, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))" % name)
+        subprocess.run([sys.executable, '-c', setup + code + report], check=True)
+# bench_float_store()
+
 # memoryview是一个内置类，它能让用户在不复制内容的情况下操作同一个数组中的不同切片
 import array
-numbers = array.array('h', [-2, -1, 0, 1, 2])
-memv = memoryview(numbers)
-print(len(memv))
-print(memv[0])
-memv_oct = memv.cast('B')
-print(memv_oct.tolist())
-memv_oct[5] = 4
-print(numbers)
+if __name__ == '__main__':
+    numbers = array.array('h', [-2, -1, 0, 1, 2])
+    memv = memoryview(numbers)
+    print(len(memv))
+    print(memv[0])
+    memv_oct = memv.cast('B')
+    print(memv_oct.tolist())
+    memv_oct[5] = 4
+    print(numbers)
+
+# 几百万个City元组，每个都要一个tuple对象加上str、float等对象，每行要几百字节
+# PackedRecords按struct格式把每个字段定长编码，所有数据放在同一个bytearray里
+# 按列存放：每个字段占一段连续的内存，这样每一列都能用memoryview.cast直接得到类型化视图
+# 扫描某一列时不会创建任何行对象，只有按下标取一行时才临时构造一个namedtuple
+# 容量不够时换一个更大的bytearray，之前拿到的列视图仍指向旧的缓冲区，需要重新获取
+import struct
+
+class PackedRecords:
+    def __init__(self, layout, capacity=1024):
+        self.layout = [(name, fmt, struct.calcsize(fmt)) for name, fmt in layout]
+        self._fields = {name: (fmt, size) for name, fmt, size in self.layout}
+        self.Record = namedtuple('Record', [name for name, fmt, size in self.layout])
+        self.row_size = sum(size for name, fmt, size in self.layout)
+        self._len = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        old_buf, old_offsets = getattr(self, '_buf', None), getattr(self, '_offsets', None)
+        self._capacity = capacity
+        self._buf = bytearray(capacity * self.row_size)
+        self._offsets = {}
+        offset = 0
+        for name, fmt, size in self.layout:
+            self._offsets[name] = offset
+            if old_buf is not None:
+                used = self._len * size
+                start = old_offsets[name]
+                self._buf[offset:offset + used] = old_buf[start:start + used]
+            offset += capacity * size
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def nbytes(self):
+        return len(self._buf)
+
+    # 整列的视图：数值字段是类型化的memoryview，定长字符串字段是'B'格式的字节视图
+    def column(self, name):
+        fmt, size = self._fields[name]
+        start = self._offsets[name]
+        view = memoryview(self._buf)[start:start + self._len * size]
+        return view if fmt.endswith('s') else view.cast(fmt)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('record index out of range')
+        values = []
+        for name, fmt, size in self.layout:
+            start = self._offsets[name] + index * size
+            value, = struct.unpack_from(fmt, self._buf, start)
+            if fmt.endswith('s'):
+                value = value.rstrip(b'\0').decode('utf-8', errors='ignore')
+            values.append(value)
+        return self.Record._make(values)
+
+    def __iter__(self):
+        return (self[i] for i in range(self._len))
+
+    # 批量装入，rows是由扁平元组组成的可迭代对象，每次处理chunk_size行
+    # 每一块先检查每行的字段数并编码好所有列，再一起写入缓冲区；出错时这一块不会留下半行数据（之前的块已经写入）
+    def extend(self, rows, chunk_size=1 << 16):
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            n = len(chunk)
+            width = len(self.layout)
+            if any(len(row) != width for row in chunk):
+                bad = next(i for i, row in enumerate(chunk) if len(row) != width)
+                raise ValueError('row %d has %d fields, expected %d'
+                                 % (self._len + bad, len(chunk[bad]), width))
+            encoded = []
+            for (name, fmt, size), values in zip(self.layout, zip(*chunk)):
+                if fmt.endswith('s'):
+                    data = b''.join(v.encode('utf-8')[:size].ljust(size, b'\0') for v in values)
+                else:
+                    data = array.array(fmt, values).tobytes()
+                encoded.append(data)
+            if self._len + n > self._capacity:
+                self._alloc(max(self._len + n, self._capacity * 2))
+            for (name, fmt, size), data in zip(self.layout, encoded):
+                start = self._offsets[name] + self._len * size
+                self._buf[start:start + n * size] = data
+            self._len += n
+
+    @classmethod
+    def from_iterable(cls, layout, rows):
+        records = cls(layout)
+        records.extend(rows)
+        return records
+
+# City的定长布局，coordinates拆成lat和long两列
+CITY_LAYOUT = [('name', '24s'), ('country', '2s'), ('population', 'd'), ('lat', 'd'), ('long', 'd')]
+if __name__ == '__main__':
+    cities = PackedRecords.from_iterable(CITY_LAYOUT, [
+        ('Tokyo', 'JP', 36.933, 35.689722, 139.691667),
+        ('Delhi NCR', 'IN', 21.935, 28.613889, 77.208889),
+    ])
+    print(cities.row_size, cities[1], cities.column('population').tolist())
+
+# 比较n个City namedtuple和PackedRecords占用的内存以及扫描一列的速度
+def bench_packed_records(n=10**6):
+    import timeit
+    import tracemalloc
+
+    def gen_rows():
+        return (('city%d' % i, 'JP', i * 0.5, 35.0 + i * 1e-6, 139.0 - i * 1e-6) for i in range(n))
+
+    tracemalloc.start()
+    city_list = [City(name, cc, pop, LatLong(lat, lon)) for name, cc, pop, lat, lon in gen_rows()]
+    tuple_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    packed = PackedRecords.from_iterable(CITY_LAYOUT, gen_rows())
+    packed_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('namedtuple    : %6.1f bytes/row' % (tuple_bytes / n))
+    print('PackedRecords : %6.1f bytes/row' % (packed_bytes / n))
+    print('scan namedtuple    :', timeit.timeit(lambda: sum(c.population for c in city_list), number=1))
+    print('scan PackedRecords :', timeit.timeit(lambda: sum(packed.column('population')), number=1))
+# bench_packed_records()
 
 # 双向队列deque
+import operator
 from collections import deque
-dq = deque(range(10), maxlen=10)
-print(dq)
-dq.rotate(3)
-print(dq)
-dq.rotate(-4)
-print(dq)
-dq.appendleft(-1)
-print(dq)
-dq.extend([11, 22, 33])
-print(dq)
-dq.extendleft([10, 20, 30, 40])
-print(dq)
\ No newline at end of file
+if __name__ == '__main__':
+    dq = deque(range(10), maxlen=10)
+    print(dq)
+    dq.rotate(3)
+    print(dq)
+    dq.rotate(-4)
+    print(dq)
+    dq.appendleft(-1)
+    print(dq)
+    dq.extend([11, 22, 33])
+    print(dq)
+    dq.extendleft([10, 20, 30, 40])
+    print(dq)
+
+# 把deque(maxlen=...)当作指标的滑动窗口时，高频的extend和rotate会成为瓶颈
+# 每次求窗口的和、最大值、最小值还要把整个窗口扫一遍
+# RingBuffer是预先分配好的array环形缓冲区，只存数值
+# extend一批数据最多只做两次切片赋值；views()返回不复制数据的memoryview
+# 整数类型码的和（sum）在每次写入时用Python的int增量更新，结果是精确的
+# 浮点数加了再减会累积舍入误差（窗口里曾有1e17时，之后的小数全被吞掉），所以浮点类型码只在写入时把和标记为失效，
+# 查询时用math.fsum对窗口重新求和（正确舍入），结果缓存到下一次写入；最小值和最大值用单调队列维护
+# 写入的值先存进一个单元素的array做类型检查和转换，检查通过后才淘汰旧元素，类型不对时缓冲区保持原样
+# 队列里的每一项是一整批数据[起始序号, 结束序号, 这批的最值]，一次extend只入队一项
+# 某批数据从左端被部分淘汰时，只对剩下的部分重新求最值（在C代码里完成）
+# appendleft、extendleft、pop、rotate会打乱单调队列，下次查询时把整个窗口当作一批重建
+class RingBuffer:
+    def __init__(self, iterable=(), maxlen=10, typecode='d'):
+        self.maxlen = maxlen
+        self.typecode = typecode
+        self._buf = array.array(typecode, [0]) * maxlen
+        self._scratch = array.array(typecode, [0])
+        self._float = typecode in ('f', 'd')
+        self._start = 0
+        self._len = 0
+        self._sum = 0.0 if self._float else 0
+        self._head_seq = 0
+        self._minq = deque()
+        self._maxq = deque()
+        self._dirty = False
+        self.extend(iterable)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for view in self.views():
+            yield from view
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('RingBuffer index out of range')
+        return self._buf[(self._start + index) % self.maxlen]
+
+    def __repr__(self):
+        return 'RingBuffer(%r, maxlen=%d)' % (list(self), self.maxlen)
+
+    # 窗口内容最多分成两段，返回一个或两个memoryview，不复制数据
+    def views(self):
+        return self._segments(0, self._len)
+
+    # 逻辑下标[i, j)对应的一个或两个memoryview
+    def _segments(self, i, j):
+        view = memoryview(self._buf)
+        start, end = self._start + i, self._start + j
+        if end <= self.maxlen:
+            return (view[start:end],)
+        if start >= self.maxlen:
+            return (view[start - self.maxlen:end - self.maxlen],)
+        return view[start:], view[:end - self.maxlen]
+
+    # 返回整个窗口或最后last个元素的单个memoryview，窗口跨过数组末尾时先整理成连续的一段
+    def window(self, last=None):
+        if self._start + self._len > self.maxlen:
+            self._linearize()
+        view = memoryview(self._buf)[self._start:self._start + self._len]
+        return view if last is None else view[max(self._len - last, 0):]
+
+    def _linearize(self):
+        buf = array.array(self.typecode, [0]) * self.maxlen
+        buf[:self._len] = array.array(self.typecode, self)
+        self._buf = buf
+        self._start = 0
+
+    # 逻辑下标[i, j)之间的一批数据入队
+    def _push_mono(self, i, j):
+        segments = self._segments(i, j)
+        start, end = self._head_seq + i, self._head_seq + j
+        low = min(min(view) for view in segments)
+        high = max(max(view) for view in segments)
+        minq, maxq = self._minq, self._maxq
+        while minq and minq[-1][2] >= low:
+            minq.pop()
+        minq.append([start, end, low])
+        while maxq and maxq[-1][2] <= high:
+            maxq.pop()
+        maxq.append([start, end, high])
+
+    def _evict_mono(self):
+        for q, better, fn in ((self._minq, operator.lt, min), (self._maxq, operator.gt, max)):
+            while q and q[0][1] <= self._head_seq:
+                q.popleft()
+            if q and q[0][0] < self._head_seq:
+                q[0][0] = self._head_seq
+                q[0][2] = fn(fn(view) for view in self._segments(0, q[0][1] - self._head_seq))
+                # 剩下部分的最值变差了，可能不再优于后一批，这时它已没有用处
+                while len(q) > 1 and not better(q[0][2], q[1][2]):
+                    q.popleft()
+
+    # 浮点类型码的和只标记为失效，查询时再用fsum重新计算
+    def _change_sum(self, delta):
+        self._sum = None if self._float else self._sum + delta
+
+    def _checked(self, value):
+        self._scratch[0] = value
+        return self._scratch[0]
+
+    def _rebuild_mono(self):
+        self._minq.clear()
+        self._maxq.clear()
+        if self._len:
+            self._push_mono(0, self._len)
+        self._dirty = False
+
+    def append(self, value):
+        value = self._checked(value)
+        if self._len == self.maxlen:
+            self.popleft()
+        self._buf[(self._start + self._len) % self.maxlen] = value
+        self._change_sum(value)
+        self._len += 1
+        if not self._dirty:
+            self._push_mono(self._len - 1, self._len)
+
+    def extend(self, iterable):
+        if isinstance(iterable, array.array) and iterable.typecode == self.typecode:
+            values = iterable
+        else:
+            values = array.array(self.typecode, iterable)
+        if not values:
+            return
+        if len(values) >= self.maxlen:
+            # 新数据就能填满窗口，只保留最后maxlen个
+            self._head_seq += self._len + len(values) - self.maxlen
+            self._buf[:] = values[len(values) - self.maxlen:]
+            self._start = 0
+            self._len = self.maxlen
+            self._sum = None if self._float else sum(self._buf)
+            self._rebuild_mono()
+            return
+        overflow = self._len + len(values) - self.maxlen
+        if overflow > 0:
+            self._change_sum(0 if self._float else -sum(sum(view) for view in self._segments(0, overflow)))
+            self._start = (self._start + overflow) % self.maxlen
+            self._len -= overflow
+            self._head_seq += overflow
+            self._evict_mono()
+        end = (self._start + self._len) % self.maxlen
+        first = min(len(values), self.maxlen - end)
+        self._buf[end:end + first] = values[:first]
+        if first < len(values):
+            self._buf[:len(values) - first] = values[first:]
+        self._change_sum(0 if self._float else sum(values))
+        self._len += len(values)
+        if not self._dirty:
+            self._push_mono(self._len - len(values), self._len)
+
+    def appendleft(self, value):
+        value = self._checked(value)
+        if self._len == self.maxlen:
+            self.pop()
+        self._start = (self._start - 1) % self.maxlen
+        self._buf[self._start] = value
+        self._change_sum(value)
+        self._len += 1
+        self._head_seq -= 1
+        self._dirty = True
+
+    def extendleft(self, iterable):
+        for value in array.array(self.typecode, iterable):
+            self.appendleft(value)
+
+    def pop(self):
+        if not self._len:
+            raise IndexError('pop from an empty RingBuffer')
+        self._len -= 1
+        value = self._buf[(self._start + self._len) % self.maxlen]
+        self._change_sum(-value)
+        self._dirty = True
+        return value
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError('pop from an empty RingBuffer')
+        value = self._buf[self._start]
+        self._start = (self._start + 1) % self.maxlen
+        self._len -= 1
+        self._change_sum(-value)
+        self._head_seq += 1
+        if not self._dirty:
+            self._evict_mono()
+        return value
+
+    # 与deque.rotate相同：n为正时把右端的n个元素移到左端
+    def rotate(self, n=1):
+        if not self._len:
+            return
+        if self._len == self.maxlen:
+            self._start = (self._start - n) % self.maxlen
+        else:
+            n %= self._len
+            items = array.array(self.typecode, self)
+            self._buf[:self._len] = items[self._len - n:] + items[:self._len - n]
+            self._start = 0
+        self._dirty = True
+
+    @property
+    def sum(self):
+        if self._sum is None:
+            self._sum = math.fsum(itertools.chain.from_iterable(self.views()))
+        return self._sum
+
+    @property
+    def mean(self):
+        return self.sum / self._len
+
+    @property
+    def min(self):
+        if self._dirty:
+            self._rebuild_mono()
+        return self._minq[0][2]
+
+    @property
+    def max(self):
+        if self._dirty:
+            self._rebuild_mono()
+        return self._maxq[0][2]
+
+if __name__ == '__main__':
+    rb = RingBuffer(range(10), maxlen=10, typecode='l')
+    rb.rotate(3)
+    rb.rotate(-4)
+    rb.appendleft(-1)
+    rb.extend([11, 22, 33])
+    rb.extendleft([10, 20, 30, 40])
+    print(rb, list(rb) == list(dq))
+    print(rb.sum, rb.min, rb.max, rb.window(3).tolist())
+
+# 比较deque和RingBuffer在批量写入并查询窗口统计量时的速度
+def bench_ring_buffer(n=10**6, batch=100, maxlen=1000):
+    import random
+    import timeit
+    data = array.array('d', (random.random() for i in range(n)))
+    batches = [data[i:i + batch] for i in range(0, n, batch)]
+
+    def use_deque():
+        window = deque(maxlen=maxlen)
+        for b in batches:
+            window.extend(b)
+            sum(window), min(window), max(window)
+
+    def use_ring_buffer():
+        window = RingBuffer(maxlen=maxlen)
+        for b in batches:
+            window.extend(b)
+            window.sum, window.min, window.max
+
+    print('deque      :', timeit.timeit(use_deque, number=1))
+    print('RingBuffer :', timeit.timeit(use_ring_buffer, number=1))
+# bench_ring_buffer()
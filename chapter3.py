@@ -1,46 +1,49 @@
 from collections import abc
-# 用instance而不是type判定某个数据是不是广义上的映射类型
-my_dict = {}
-print(isinstance(my_dict, abc.Mapping))
-
-# 如果一个对象是可散列的，那么在这个对象的生命周期中，它的散列值是不变的
-# 原子不可变数据类型（str, bytes和数值类型）都是可散列类型，frozenset也是可散列的
-# 如果一个自定义对象实现了__eq__方法，并且在方法中用到了这个对象的内部状态的话
-# 那么只有当所有这些内部状态都是不可变的情况下，这个对象才是可散列的
-
-# 字典构造方法
-a = dict(one=1, two=2, three=3)
-b = {'one': 1, 'two': 2, 'three': 3}
-c = dict(zip(['one', 'two', 'three'], [1, 2, 3]))
-d = dict([('two', 2), ('one', 1), ('three', 3)])
-e = dict({'three': 3, 'one': 1, 'two': 2})
+if __name__ == '__main__':
+    # 用instance而不是type判定某个数据是不是广义上的映射类型
+    my_dict = {}
+    print(isinstance(my_dict, abc.Mapping))
+
+    # 如果一个对象是可散列的，那么在这个对象的生命周期中，它的散列值是不变的
+    # 原子不可变数据类型（str, bytes和数值类型）都是可散列类型，frozenset也是可散列的
+    # 如果一个自定义对象实现了__eq__方法，并且在方法中用到了这个对象的内部状态的话
+    # 那么只有当所有这些内部状态都是不可变的情况下，这个对象才是可散列的
+
+    # 字典构造方法
+    a = dict(one=1, two=2, three=3)
+    b = {'one': 1, 'two': 2, 'three': 3}
+    c = dict(zip(['one', 'two', 'three'], [1, 2, 3]))
+    d = dict([('two', 2), ('one', 1), ('three', 3)])
+    e = dict({'three': 3, 'one': 1, 'two': 2})
 
 # 字典推导
 DIAL_CODES = [(86, 'China'), (91, 'India'), (1, 'United States')]
-country_code = {country: code for code, country in DIAL_CODES}
-print(country_code)
-country_code = {code: country.upper() for code, country in DIAL_CODES if code < 66}
-print(country_code)
-
-# 用setdefault处理找不到的键
-my_dict = {'one': [1], 'two': [2], 'three': [3]}
-key = 'four'
-value = 4
-# 不好的实现
-# occurences = my_dict.get(key, [])
-# occurences.append(value)
-# my_dict[key] = occurences
-# print(my_dict)
-# 好的实现
-my_dict.setdefault(key, []).append(value)
-print(my_dict)
+if __name__ == '__main__':
+    country_code = {country: code for code, country in DIAL_CODES}
+    print(country_code)
+    country_code = {code: country.upper() for code, country in DIAL_CODES if code < 66}
+    print(country_code)
+
+    # 用setdefault处理找不到的键
+    my_dict = {'one': [1], 'two': [2], 'three': [3]}
+    key = 'four'
+    value = 4
+    # 不好的实现
+    # occurences = my_dict.get(key, [])
+    # occurences.append(value)
+    # my_dict[key] = occurences
+    # print(my_dict)
+    # 好的实现
+    my_dict.setdefault(key, []).append(value)
+    print(my_dict)
 
 # 某个键不在映射里，但仍希望通过这个这个键读取到默认值
 # 两种方法 --> 1. defaultdict 2.自定义dict，实现__missing__方法
 import collections
-index = collections.defaultdict(list)
-index[key].append(value)
-print(index)
+if __name__ == '__main__':
+    index = collections.defaultdict(list)
+    index[key].append(value)
+    print(index)
 # defaultdict中的default_factory只会在__getitem__中调用
 # 如d为defaultdict，d[k]会调用default_factory，d.get(k)会返回None
 
@@ -49,7 +52,7 @@ class StrKeyDict0(dict):
     def __missing__(self, key):
         if isinstance(key, str):
             raise KeyError(key)
-        return self[key]
+        return self[str(key)]
 
     def get(self, key, default=None):
         try:
@@ -73,17 +76,336 @@ class StrKeyDict0(dict):
 # 这些对象会被当做一个整体逐个查找，直到键被找到为止
 from collections import ChainMap
 import builtins
-pylookup = ChainMap(locals(), globals(), vars(builtins))
-print(pylookup)
+if __name__ == '__main__':
+    pylookup = ChainMap(locals(), globals(), vars(builtins))
+    print(pylookup)
+
+# ChainMap每次查找都要从第一个映射开始逐个查，层数多时，未命中或命中深层的键代价与层数成正比
+# CachedChainMap另外维护一个合并后的索引_index，读操作只查这一个dict，与层数无关
+# 索引在第一次使用时一次性建好（从最底层开始依次update）
+# 某一层改动了某个键时，只重新计算这一个键：LayerDict会通知所有用到它的CachedChainMap
+# 普通dict的改动无法被察觉，改过之后需要调用refresh()
+import weakref
+
+class LayerDict(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ChainMap不可散列，用id作键，用弱引用保存，不会让CachedChainMap无法被回收
+        self._owners = weakref.WeakValueDictionary()
+
+    def _changed(self, key):
+        for owner in list(self._owners.values()):
+            owner._refresh_key(key)
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._changed(key)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed(key)
+
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        self._changed(key)
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._changed(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        for owner in list(self._owners.values()):
+            owner.refresh()
+
+    # dict的|=不经过update，改动不会通知CachedChainMap；|得到的新字典是一个还没有被引用的LayerDict
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        new = LayerDict(self)
+        new.update(other)
+        return new
+
+    def __ror__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        new = LayerDict(other)
+        new.update(self)
+        return new
+
+class CachedChainMap(ChainMap):
+    def __init__(self, *maps):
+        super().__init__(*maps)
+        self._index = None
+        for m in self.maps:
+            if isinstance(m, LayerDict):
+                m._owners[id(self)] = self
+
+    def refresh(self):
+        self._index = None
+
+    def _build_index(self):
+        index = {}
+        for m in reversed(self.maps):
+            index.update(m)
+        self._index = index
+        return index
+
+    def _get_index(self):
+        return self._index if self._index is not None else self._build_index()
+
+    def _refresh_key(self, key):
+        if self._index is None:
+            return
+        for m in self.maps:
+            if key in m:
+                self._index[key] = m[key]
+                return
+        self._index.pop(key, None)
+
+    # __getitem__是最常用的读操作，直接内联_get_index省掉一次方法调用
+    def __getitem__(self, key):
+        index = self._index if self._index is not None else self._build_index()
+        try:
+            return index[key]
+        except KeyError:
+            return self.__missing__(key)
+
+    def get(self, key, default=None):
+        index = self._get_index()
+        return index.get(key, default)
+
+    def __contains__(self, key):
+        index = self._get_index()
+        return key in index
+
+    def __len__(self):
+        index = self._get_index()
+        return len(index)
+
+    def __iter__(self):
+        index = self._get_index()
+        return iter(index)
+
+    # 写操作与ChainMap一样只作用于第一层，写完后同步索引
+    def __setitem__(self, key, value):
+        self.maps[0][key] = value
+        self._refresh_key(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._refresh_key(key)
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self._refresh_key(key)
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._refresh_key(key)
+        return key, value
+
+    def clear(self):
+        self.maps[0].clear()
+        self.refresh()
+
+    # ChainMap的|=和|直接改第一层，copy把第一层复制成普通dict，这里都改成经过__setitem__，第一层保持LayerDict
+    # 副本是一个新的CachedChainMap，有自己的索引，也会登记到共用的各层上
+    def copy(self):
+        return self.__class__(LayerDict(self.maps[0]), *self.maps[1:])
+
+    __copy__ = copy
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __or__(self, other):
+        if not isinstance(other, abc.Mapping):
+            return NotImplemented
+        m = self.copy()
+        m.update(other)
+        return m
+
+    def __ror__(self, other):
+        if not isinstance(other, abc.Mapping):
+            return NotImplemented
+        m = LayerDict(other)
+        for child in reversed(self.maps):
+            m.update(child)
+        return self.__class__(m)
+
+    # new_child默认新建的一层是LayerDict，这样之后对它的修改也会同步到索引
+    def new_child(self, m=None, **kwargs):
+        if m is None:
+            m = LayerDict(kwargs)
+        elif kwargs:
+            m.update(kwargs)
+        return self.__class__(m, *self.maps)
+
+if __name__ == '__main__':
+    layers = [LayerDict(level=i, **{'key%d' % i: i}) for i in range(3)]
+    config = CachedChainMap(*layers)
+    print(config['level'], config['key2'], config.parents['level'])
+    layers[0]['key2'] = 'override'
+    child = config.new_child(level='child')
+    print(config['key2'], child['level'], len(child))
+
+# 层数从1到100，比较ChainMap和CachedChainMap查找最底层的键以及未命中时的耗时
+def bench_cached_chain_map(depths=(1, 10, 25, 50, 100), n=10**5):
+    import timeit
+    for depth in depths:
+        maps = [LayerDict({'layer%d_%d' % (i, j): j for j in range(10)}) for i in range(depth)]
+        deep_key = 'layer%d_0' % (depth - 1)
+        plain = ChainMap(*maps)
+        cached = CachedChainMap(*maps)
+        row = []
+        for cm in (plain, cached):
+            hit = timeit.timeit(lambda: cm[deep_key], number=n) / n * 1e9
+            miss = timeit.timeit(lambda: cm.get('missing'), number=n) / n * 1e9
+            row.append('hit %7.1fns miss %7.1fns' % (hit, miss))
+        print('depth %3d  ChainMap: %s  CachedChainMap: %s' % (depth, row[0], row[1]))
+# bench_cached_chain_map()
 
 # collections.Counter
 # 为键准备一个整数计数器，每次更新一个键的时候都会增加这个计数器
 from collections import Counter
-ct = collections.Counter('abracasfasfaz')
-print(ct)
-ct.update('aaaaaaaaaaazz')
-print(ct)
-print(ct.most_common(2))
+if __name__ == '__main__':
+    ct = collections.Counter('abracasfasfaz')
+    print(ct)
+    ct.update('aaaaaaaaaaazz')
+    print(ct)
+    print(ct.most_common(2))
+
+# 数据量很大时单进程的Counter受限于CPU，sharded_count把输入切成块，交给进程池分别计数后再合并
+# 每块用Counter(...)计数，它的计数循环在C里完成；合并时用update把各块的结果加起来
+# most_common(k)传入k时内部用heapq.nlargest，不会对全部元素排序
+# approx_k不为None时改用SpaceSaving近似计数，每块和最终结果最多只保留approx_k个元素
+# 切块和进程池的执行循环与chapter4的fold_lines、chapter5的Pipeline共用fluentpython._pool.map_chunks，
+# 同一时刻最多只有2*workers个块在进程池中
+import heapq
+import itertools
+import os
+from functools import partial
+
+from fluentpython._pool import chunks, map_chunks
+
+def _count_chunk(chunk, tokenize=None, approx_k=None):
+    if tokenize is not None:
+        chunk = [token for item in chunk for token in tokenize(item)]
+    counter = Counter(chunk)
+    if approx_k is None:
+        return counter
+    summary = SpaceSaving(approx_k)
+    summary.update(counter)
+    return summary
+
+def sharded_count(iterable, workers=None, chunk_size=10000, tokenize=None, approx_k=None):
+    total = Counter() if approx_k is None else SpaceSaving(approx_k)
+    count = partial(_count_chunk, tokenize=tokenize, approx_k=approx_k)
+    mode = 'serial' if workers == 1 else 'process'
+    for counted in map_chunks(count, iterable, chunk_size, workers, mode):
+        total.update(counted)
+    return total
+
+# Space-Saving算法：只保留k个计数器，新元素到来而计数器已满时，顶替计数最小的那个
+# 被顶替的计数记为误差，所以每个元素的估计值都不小于真实值，最多多出error
+# update接受可迭代对象或映射（如一块数据的Counter），两个SpaceSaving也可以直接合并
+# 可迭代对象按SPACE_SAVING_CHUNK个元素一块读入，每块先用Counter合并相同元素再逐个add，内存占用只与块大小和k有关
+# 最小计数用一个惰性删除的堆来找：堆里过时的条目在弹出时跳过
+SPACE_SAVING_CHUNK = 10000
+
+class SpaceSaving:
+    def __init__(self, k):
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.counts[item], id(item), item))
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(c, id(i), i) for i, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, _, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def add(self, item, count=1, error=0):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+            self.errors[item] += error
+        elif len(counts) < self.k:
+            counts[item] = count
+            self.errors[item] = error
+        else:
+            victim, low = self._pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            counts[item] = low + count
+            self.errors[item] = low + error
+        self._push(item)
+
+    def update(self, iterable):
+        if isinstance(iterable, SpaceSaving):
+            for item, count in iterable.counts.items():
+                self.add(item, count, iterable.errors[item])
+        elif isinstance(iterable, abc.Mapping):
+            for item, count in iterable.items():
+                self.add(item, count)
+        else:
+            for chunk in chunks(iterable, SPACE_SAVING_CHUNK):
+                self.update(Counter(chunk))
+
+    def most_common(self, n=None):
+        if n is None:
+            return sorted(self.counts.items(), key=lambda pair: pair[1], reverse=True)
+        return heapq.nlargest(n, self.counts.items(), key=lambda pair: pair[1])
+
+if __name__ == '__main__':
+    print(sharded_count('abracasfasfaz' * 100, workers=1, chunk_size=7) == Counter('abracasfasfaz' * 100))
+    print(sharded_count('abracasfasfaz' * 100, workers=1, approx_k=3).most_common(2))
+
+# 在1到cpu_count个进程下对同一批文本计数，并检查结果与单进程Counter完全一致
+# 词频按Zipf分布生成，和真实日志里的情况相近
+def bench_sharded_count(n_lines=10**6, words_per_line=10, vocabulary=10**5):
+    import random
+    import time
+    words = ['w%d' % i for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    lines = [' '.join(random.choices(words, weights, k=words_per_line)) for i in range(n_lines)]
+    t0 = time.perf_counter()
+    expected = Counter(w for line in lines for w in line.split())
+    print('Counter    : %.3fs' % (time.perf_counter() - t0))
+    for workers in range(1, (os.cpu_count() or 1) + 1):
+        t0 = time.perf_counter()
+        result = sharded_count(lines, workers=workers, tokenize=str.split)
+        print('%2d workers : %.3fs  exact=%s' % (workers, time.perf_counter() - t0, result == expected))
+    t0 = time.perf_counter()
+    approx = sharded_count(lines, tokenize=str.split, approx_k=1000)
+    print('approx     : %.3fs  top10 %s' % (time.perf_counter() - t0,
+          [w for w, c in approx.most_common(10)] == [w for w, c in expected.most_common(10)]))
+# bench_sharded_count()
 
 # collections.UserDict
 # 把标准的dict用纯python又实现了一遍，用来让用户继承写子类
@@ -95,24 +417,346 @@ class StrKeyDict(collections.UserDict):
 
     # data是一个dict的实例，是UserDict中最终存储数据的地方
     def __contains__(self, item):
-        return str(key) in self.data
+        return str(item) in self.data
 
+    # 存入时就把键转换成str，这样__contains__只需要查一次
     def __setitem__(self, key, value):
-        self.data[key] = value
+        self.data[str(key)] = value
+
+# StrKeyDict0和StrKeyDict遇到非str的键时，先查一次失败，进入__missing__，再回到__getitem__查第二次
+# StrKeyDict0.__contains__还要在两个键视图里查找
+# FastStrKeyDict在写入时就把键转换成str，get和in都只查一次散列表
+# 没有覆盖__getitem__，所以str键的d[k]仍然走dict的C实现；只有非str键才进入__missing__，转换后直接查一次
+class FastStrKeyDict(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.update(*args, **kwargs)
+
+    def __missing__(self, key):
+        if isinstance(key, str):
+            raise KeyError(key)
+        return dict.__getitem__(self, str(key))
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key if isinstance(key, str) else str(key), value)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key if isinstance(key, str) else str(key))
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key if isinstance(key, str) else str(key))
+
+    def get(self, key, default=None):
+        return dict.get(self, key if isinstance(key, str) else str(key), default)
+
+    def pop(self, key, *default):
+        return dict.pop(self, key if isinstance(key, str) else str(key), *default)
+
+    def setdefault(self, key, default=None):
+        return dict.setdefault(self, key if isinstance(key, str) else str(key), default)
+
+    # 批量写入，other可以是映射或由键值对组成的可迭代对象，键的转换在生成器里完成后一次交给dict.update
+    def update(self, other=(), **kwargs):
+        if isinstance(other, abc.Mapping):
+            other = other.items()
+        dict.update(self, ((k if isinstance(k, str) else str(k), v) for k, v in other))
+        if kwargs:
+            dict.update(self, kwargs)
+
+    def copy(self):
+        return FastStrKeyDict(self)
+
+    # dict的|和|=不经过update，直接在C里写入原来的键，所以也要覆盖
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __or__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        new = self.copy()
+        new.update(other)
+        return new
+
+    def __ror__(self, other):
+        if not isinstance(other, dict):
+            return NotImplemented
+        new = FastStrKeyDict(other)
+        new.update(self)
+        return new
+
+if __name__ == '__main__':
+    fd = FastStrKeyDict([('2', 'two'), (4, 'four')])
+    print(fd[2], fd['4'], fd.get(1, 'N/A'), 2 in fd, 1 in fd)
+
+# 比较四种映射在命中和未命中时的查找延迟（纳秒/次）
+def bench_str_key_dict(n=10**5):
+    import timeit
+    items = [(str(i), i) for i in range(n)]
+    str_keys = [str(i) for i in range(n)]
+    int_keys = list(range(n))
+    miss_keys = [str(i) for i in range(n, 2 * n)]
+    plain = dict(items)
+    skd0 = StrKeyDict0(items)
+    skd = StrKeyDict(items)
+    fast = FastStrKeyDict(items)
+    for name, d in [('dict', plain), ('StrKeyDict0', skd0), ('StrKeyDict', skd), ('FastStrKeyDict', fast)]:
+        row = [name]
+        for label, keys in [('str []', str_keys), ('int get', int_keys), ('str in', str_keys), ('miss get', miss_keys)]:
+            if label == 'str []':
+                stmt = lambda: [d[k] for k in keys]
+            elif label == 'str in':
+                stmt = lambda: [k in d for k in keys]
+            else:
+                stmt = lambda: [d.get(k) for k in keys]
+            row.append('%s %6.1f' % (label, timeit.timeit(stmt, number=3) / (3 * n) * 1e9))
+        print('%-15s' % row[0], '  '.join(row[1:]))
+# bench_str_key_dict()
 
 # 不可变映射类型
 # 比如不能让用户错误地修改某个映射
 # MappingProxyType，如果给这个类一个映射，它会返回一个只读的映射视图
 # 如果对原映射作出了改动，我们通过这个视图可以观察到，但无法通过这个视图对原映射作出修改
 from types import MappingProxyType
-d = {1: 'A'}
-d_proxy = MappingProxyType(d)
-print(d_proxy)
-print(d_proxy[1])
-# 这句报错
-# d_proxy[2] = 'x'
-d[2] = 'B'
-print(d_proxy[2])
+if __name__ == '__main__':
+    d = {1: 'A'}
+    d_proxy = MappingProxyType(d)
+    print(d_proxy)
+    print(d_proxy[1])
+    # 这句报错
+    # d_proxy[2] = 'x'
+    d[2] = 'B'
+    print(d_proxy[2])
+
+# MappingProxyType的视图是“活”的，其他线程正在修改原字典时，读者可能看到改了一半的状态
+# 要得到一致的快照只能dict(d)复制一份，每个读者都要O(n)
+# PersistentMap是不可变的HAMT（哈希数组映射字典树）：每层用散列值的5位选择分支，
+# 每个节点用一个位图记录哪些分支存在，entries只存存在的分支
+# 修改时只复制从根到叶子的这一条路径，其余节点新旧版本共享，所以set和delete都是O(log n)
+# SnapshotDict是可变的包装，每次写入都换上一个新版本；snapshot()直接把当前版本包进MappingProxyType，是O(1)的
+# entries中的元素有三种：叶子(hash, key, value)元组、子节点_Node、散列值完全相同时的_Collision
+HAMT_BITS = 5
+HAMT_MASK = (1 << HAMT_BITS) - 1
+HASH_MASK = (1 << 64) - 1
+
+class _Node:
+    __slots__ = ('bitmap', 'entries')
+
+    def __init__(self, bitmap, entries):
+        self.bitmap = bitmap
+        self.entries = entries
+
+class _Collision:
+    __slots__ = ('hash', 'entries')
+
+    def __init__(self, hash_, entries):
+        self.hash = hash_
+        self.entries = entries
+
+def _hamt_get(node, h, key):
+    shift = 0
+    while True:
+        if type(node) is _Collision:
+            if node.hash == h:
+                for k, v in node.entries:
+                    if k is key or k == key:
+                        return v
+            raise KeyError(key)
+        bit = 1 << ((h >> shift) & HAMT_MASK)
+        if not node.bitmap & bit:
+            raise KeyError(key)
+        entry = node.entries[(node.bitmap & (bit - 1)).bit_count()]
+        if type(entry) is tuple:
+            if entry[0] == h and (entry[1] is key or entry[1] == key):
+                return entry[2]
+            raise KeyError(key)
+        node = entry
+        shift += HAMT_BITS
+
+# 把散列值不同的两个条目放到同一个新节点下，前几位相同就继续往下分
+def _hamt_merge(h1, e1, h2, e2, shift):
+    if h1 == h2:
+        pairs = []
+        for entry in (e1, e2):
+            pairs.extend([entry[1:]] if type(entry) is tuple else entry.entries)
+        return _Collision(h1, pairs)
+    b1 = (h1 >> shift) & HAMT_MASK
+    b2 = (h2 >> shift) & HAMT_MASK
+    if b1 == b2:
+        return _Node(1 << b1, [_hamt_merge(h1, e1, h2, e2, shift + HAMT_BITS)])
+    return _Node((1 << b1) | (1 << b2), [e1, e2] if b1 < b2 else [e2, e1])
+
+# 返回(新节点, 是否新增了键)
+def _hamt_assoc(node, h, shift, key, value):
+    if type(node) is _Collision:
+        if node.hash != h:
+            return _hamt_merge(node.hash, node, h, (h, key, value), shift), True
+        for i, (k, v) in enumerate(node.entries):
+            if k is key or k == key:
+                entries = list(node.entries)
+                entries[i] = (k, value)
+                return _Collision(h, entries), False
+        return _Collision(h, node.entries + [(key, value)]), True
+    bit = 1 << ((h >> shift) & HAMT_MASK)
+    idx = (node.bitmap & (bit - 1)).bit_count()
+    if not node.bitmap & bit:
+        return _Node(node.bitmap | bit, node.entries[:idx] + [(h, key, value)] + node.entries[idx:]), True
+    entry = node.entries[idx]
+    if type(entry) is tuple:
+        eh, ek, ev = entry
+        if eh == h and (ek is key or ek == key):
+            if ev is value:
+                return node, False
+            new_entry, added = (eh, ek, value), False
+        else:
+            new_entry, added = _hamt_merge(eh, entry, h, (h, key, value), shift + HAMT_BITS), True
+    else:
+        new_entry, added = _hamt_assoc(entry, h, shift + HAMT_BITS, key, value)
+    entries = list(node.entries)
+    entries[idx] = new_entry
+    return _Node(node.bitmap, entries), added
+
+# 返回删除后的节点；节点空了返回None，只剩一个叶子时返回这个叶子，由上一层直接存放
+def _hamt_dissoc(node, h, shift, key):
+    if type(node) is _Collision:
+        entries = [(k, v) for k, v in node.entries if not (k is key or k == key)]
+        if node.hash != h or len(entries) == len(node.entries):
+            raise KeyError(key)
+        if len(entries) == 1:
+            return (h,) + entries[0]
+        return _Collision(h, entries)
+    bit = 1 << ((h >> shift) & HAMT_MASK)
+    if not node.bitmap & bit:
+        raise KeyError(key)
+    idx = (node.bitmap & (bit - 1)).bit_count()
+    entry = node.entries[idx]
+    if type(entry) is tuple:
+        if not (entry[0] == h and (entry[1] is key or entry[1] == key)):
+            raise KeyError(key)
+        new_entry = None
+    else:
+        new_entry = _hamt_dissoc(entry, h, shift + HAMT_BITS, key)
+    if new_entry is None:
+        bitmap = node.bitmap & ~bit
+        if not bitmap:
+            return None
+        entries = node.entries[:idx] + node.entries[idx + 1:]
+        if shift and len(entries) == 1 and type(entries[0]) is not _Node:
+            return entries[0]
+        return _Node(bitmap, entries)
+    entries = list(node.entries)
+    entries[idx] = new_entry
+    return _Node(node.bitmap, entries)
+
+def _hamt_items(node):
+    for entry in node.entries:
+        if type(entry) is tuple:
+            yield entry[1], entry[2]
+        elif type(entry) is _Collision:
+            yield from entry.entries
+        else:
+            yield from _hamt_items(entry)
+
+class PersistentMap(abc.Mapping):
+    __slots__ = ('_root', '_len')
+
+    def __init__(self, mapping=()):
+        self._root = _Node(0, [])
+        self._len = 0
+        items = mapping.items() if isinstance(mapping, abc.Mapping) else mapping
+        for key, value in items:
+            self._root, added = _hamt_assoc(self._root, hash(key) & HASH_MASK, 0, key, value)
+            self._len += added
+
+    @classmethod
+    def _make(cls, root, length):
+        new = cls.__new__(cls)
+        new._root = root
+        new._len = length
+        return new
+
+    def __getitem__(self, key):
+        return _hamt_get(self._root, hash(key) & HASH_MASK, key)
+
+    def __iter__(self):
+        return (key for key, value in _hamt_items(self._root))
+
+    def __len__(self):
+        return self._len
+
+    def items(self):
+        return _hamt_items(self._root)
+
+    def __repr__(self):
+        return 'PersistentMap({%s})' % ', '.join('%r: %r' % pair for pair in self.items())
+
+    # 以下方法都返回新版本，原版本不变
+    def set(self, key, value):
+        root, added = _hamt_assoc(self._root, hash(key) & HASH_MASK, 0, key, value)
+        return self if root is self._root else PersistentMap._make(root, self._len + added)
+
+    def delete(self, key):
+        root = _hamt_dissoc(self._root, hash(key) & HASH_MASK, 0, key)
+        return PersistentMap._make(root if root is not None else _Node(0, []), self._len - 1)
+
+    def update(self, other=(), **kwargs):
+        new = self
+        items = other.items() if isinstance(other, abc.Mapping) else other
+        for key, value in itertools.chain(items, kwargs.items()):
+            new = new.set(key, value)
+        return new
+
+class SnapshotDict(abc.MutableMapping):
+    def __init__(self, other=(), **kwargs):
+        self._map = PersistentMap().update(other, **kwargs)
+
+    def __getitem__(self, key):
+        return self._map[key]
+
+    def __setitem__(self, key, value):
+        self._map = self._map.set(key, value)
+
+    def __delitem__(self, key):
+        self._map = self._map.delete(key)
+
+    # 迭代的是调用时的那个版本，迭代过程中修改字典也不会出错
+    def __iter__(self):
+        return iter(self._map)
+
+    def __len__(self):
+        return len(self._map)
+
+    def __repr__(self):
+        return 'SnapshotDict(%r)' % dict(self._map.items())
+
+    def snapshot(self):
+        return MappingProxyType(self._map)
+
+if __name__ == '__main__':
+    sd = SnapshotDict({1: 'A'})
+    sd_proxy = sd.snapshot()
+    sd[2] = 'B'
+    print(sd_proxy, len(sd_proxy), sd.snapshot()[2])
+
+# 10^6个键时，比较dict+MappingProxyType（复制后包装）与SnapshotDict的快照和更新代价
+def bench_snapshot_dict(n=10**6, updates=10**4):
+    import timeit
+    plain = {i: i for i in range(n)}
+    persistent = SnapshotDict(plain)
+    print('snapshot dict copy    : %.6fs' % timeit.timeit(lambda: MappingProxyType(dict(plain)), number=1))
+    print('snapshot SnapshotDict : %.6fs' % timeit.timeit(persistent.snapshot, number=1))
+
+    def update_dict():
+        for i in range(updates):
+            plain[i] = -i
+
+    def update_persistent():
+        for i in range(updates):
+            persistent[i] = -i
+
+    print('update dict           : %.1fns/op' % (timeit.timeit(update_dict, number=1) / updates * 1e9))
+    print('update SnapshotDict   : %.1fns/op' % (timeit.timeit(update_persistent, number=1) / updates * 1e9))
+# bench_snapshot_dict()
 
 # 集合
 # a | b 返回合集
@@ -128,6 +772,384 @@ print(d_proxy[2])
 
 # 同样有集合推导的概念
 
+# 集合里全是非负整数、元素又多达上千万时，set每个元素要占30~70字节
+# RoaringSet按roaring bitmap的思路压缩存储：元素按高位（x >> 16）分桶，每个桶只存低16位
+# 每个桶（容器）在三种表示中选占用字节最少的一种：
+#   ARRAY  --> 元素不多时，排好序的array('H')，每个元素2字节
+#   BITMAP --> 元素很多时，用一个65536位的int当位图，固定8KB，与、或、异或都由int运算在C里完成
+#   RUN    --> 元素大多连成片时，array('H')依次存每一段的[起点, 终点]
+# 集合运算只在高位相同的桶之间进行：两个ARRAY桶直接借助set求，其余情况都转成位图按位运算
+# 容器建好后不再原地修改，所以运算结果可以直接共享输入里的容器
+# 只支持0 <= x < 2**64的整数；to_bytes/from_bytes用的是自己的格式，不兼容其他roaring实现
+import array
+import bisect
+import operator
+import struct
+import sys
+
+ARRAY, BITMAP, RUN = 0, 1, 2
+ARRAY_MAX = 4096
+BITMAP_BYTES = 8192
+_BIT_FLAGS = bytes.maketrans(b'01', b'\x00\x01')
+_SET_HEADER = struct.Struct('<4sI')
+_CONTAINER_HEADER = struct.Struct('<QBII')
+
+# bin()的结果去掉'0b'再倒过来，第i个字符就是第i位
+# 元素多时用compress一次挑出为1的下标，循环在C里；元素少时用find逐个跳到下一个'1'更快
+def _bits_to_lows(bits):
+    digits = bin(bits)[:1:-1]
+    if bits.bit_count() > ARRAY_MAX:
+        return itertools.compress(range(len(digits)), digits.encode('ascii').translate(_BIT_FLAGS))
+    return _find_ones(digits)
+
+def _find_ones(digits):
+    i = digits.find('1')
+    while i >= 0:
+        yield i
+        i = digits.find('1', i + 1)
+
+def _lows_to_bits(lows):
+    flags = bytearray(b'0') * 65536
+    for low in lows:
+        flags[low] = 49  # ord('1')
+    return int(flags[::-1], 2)
+
+# bits ^ (bits << 1)中，每一段连续的1都贡献起点和终点后一位两个1，由此可以不展开就数出段数
+def _from_bits(bits):
+    card = bits.bit_count()
+    if not card:
+        return None
+    edges = bits ^ (bits << 1)
+    runs = edges.bit_count() // 2
+    if 4 * runs < min(2 * card, BITMAP_BYTES):
+        edges = list(_bits_to_lows(edges))
+        data = array.array('H', [0]) * (2 * runs)
+        data[0::2] = array.array('H', edges[0::2])
+        data[1::2] = array.array('H', map(operator.sub, edges[1::2], itertools.repeat(1)))
+        return RUN, data, card
+    if card <= ARRAY_MAX:
+        return ARRAY, array.array('H', _bits_to_lows(bits)), card
+    return BITMAP, bits, card
+
+def _to_bits(container):
+    kind, data, card = container
+    if kind == BITMAP:
+        return data
+    if kind == ARRAY:
+        return _lows_to_bits(data)
+    bits = 0
+    for start, last in zip(data[0::2], data[1::2]):
+        bits |= ((1 << (last - start + 1)) - 1) << start
+    return bits
+
+def _iter_lows(container):
+    kind, data, card = container
+    if kind == ARRAY:
+        return iter(data)
+    if kind == BITMAP:
+        return _bits_to_lows(data)
+    return itertools.chain.from_iterable(range(start, last + 1) for start, last in zip(data[0::2], data[1::2]))
+
+def _container_contains(container, low):
+    kind, data, card = container
+    if kind == ARRAY:
+        i = bisect.bisect_left(data, low)
+        return i < len(data) and data[i] == low
+    if kind == BITMAP:
+        return data >> low & 1 == 1
+    # RUN的data是[起点, 终点, 起点, 终点...]，整体有序；落在奇数位置或正好等于某个终点就在集合里
+    i = bisect.bisect_right(data, low)
+    return i % 2 == 1 or (i > 0 and data[i - 1] == low)
+
+# 由排好序、没有重复的低16位建容器：元素不多时直接数出段数来决定用ARRAY还是RUN，不必先转成位图
+def _from_lows(lows):
+    if not lows:
+        return None
+    if len(lows) <= ARRAY_MAX:
+        runs = 1 + sum(map(operator.ne, lows[1:], map(operator.add, lows, itertools.repeat(1))))
+        if 4 * runs >= 2 * len(lows):
+            return ARRAY, array.array('H', lows), len(lows)
+    return _from_bits(_lows_to_bits(lows))
+
+# 差集和对称差集：位图上没有现成的“差”运算，用a & ~b代替
+_PAIR_OPS = {
+    'sub': (lambda a, b: a & ~b, set.difference),
+    'xor': (operator.xor, set.symmetric_difference),
+}
+
+class RoaringSet(abc.MutableSet):
+    def __init__(self, iterable=()):
+        self._containers = {}
+        if isinstance(iterable, RoaringSet):
+            self._containers = dict(iterable._containers)
+            return
+        values = sorted(iterable)
+        if values and (values[0] < 0 or values[-1] >= 1 << 64):
+            raise ValueError('RoaringSet elements must be in range(2**64)')
+        # 排序后用bisect找出每个桶的边界，一次建好一个桶
+        lo = 0
+        while lo < len(values):
+            high = values[lo] >> 16
+            hi = bisect.bisect_left(values, (high + 1) << 16, lo)
+            lows = map(operator.sub, values[lo:hi], itertools.repeat(high << 16))
+            self._containers[high] = _from_lows(list(dict.fromkeys(lows)))
+            lo = hi
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return cls(it)
+
+    @classmethod
+    def _from_containers(cls, containers):
+        result = cls()
+        result._containers = {high: c for high, c in containers.items() if c is not None}
+        return result
+
+    def __len__(self):
+        return sum(c[2] for c in self._containers.values())
+
+    def __contains__(self, x):
+        if not isinstance(x, int) or x < 0:
+            return False
+        container = self._containers.get(x >> 16)
+        return container is not None and _container_contains(container, x & 0xFFFF)
+
+    def __iter__(self):
+        for high in sorted(self._containers):
+            yield from map(operator.add, _iter_lows(self._containers[high]), itertools.repeat(high << 16))
+
+    def __repr__(self):
+        if len(self) <= 10:
+            return 'RoaringSet(%r)' % list(self)
+        return '<RoaringSet with %d elements in %d containers>' % (len(self), len(self._containers))
+
+    # 单个元素的增删适合零星修改，大量数据应一次性传给构造方法
+    def add(self, x):
+        x = operator.index(x)
+        if not 0 <= x < 1 << 64:
+            raise ValueError('RoaringSet elements must be in range(2**64)')
+        high, low = x >> 16, x & 0xFFFF
+        container = self._containers.get(high)
+        if container is None:
+            self._containers[high] = ARRAY, array.array('H', [low]), 1
+        elif not _container_contains(container, low):
+            if container[0] == ARRAY and container[2] < ARRAY_MAX:
+                data = array.array('H', container[1])
+                bisect.insort(data, low)
+                self._containers[high] = ARRAY, data, container[2] + 1
+            else:
+                self._containers[high] = _from_bits(_to_bits(container) | 1 << low)
+
+    def discard(self, x):
+        if x not in self:
+            return
+        high, low = x >> 16, x & 0xFFFF
+        container = self._containers[high]
+        if container[0] == ARRAY:
+            new = _from_lows([v for v in container[1] if v != low])
+        else:
+            new = _from_bits(_to_bits(container) & ~(1 << low))
+        if new is None:
+            del self._containers[high]
+        else:
+            self._containers[high] = new
+
+    def clear(self):
+        self._containers = {}
+
+    @staticmethod
+    def _coerce(other):
+        return other if isinstance(other, RoaringSet) else RoaringSet(other)
+
+    # 可以一次传入多个集合；先求出所有集合共有的高位，再按元素数从少到多逐个求交
+    def intersection(self, *others):
+        sets = sorted([self] + [self._coerce(o) for o in others], key=len)
+        highs = set(sets[0]._containers).intersection(*(s._containers for s in sets[1:]))
+        result = {}
+        for high in highs:
+            containers = [s._containers[high] for s in sets]
+            if all(c[0] == ARRAY for c in containers):
+                lows = set(containers[0][1]).intersection(*(c[1] for c in containers[1:]))
+                result[high] = _from_lows(sorted(lows))
+                continue
+            bits = _to_bits(containers[0])
+            for c in containers[1:]:
+                bits &= _to_bits(c)
+                if not bits:
+                    break
+            result[high] = _from_bits(bits)
+        return self._from_containers(result)
+
+    def union(self, *others):
+        sets = [self] + [self._coerce(o) for o in others]
+        grouped = collections.defaultdict(list)
+        for s in sets:
+            for high, container in s._containers.items():
+                grouped[high].append(container)
+        result = {}
+        for high, containers in grouped.items():
+            if len(containers) == 1:
+                result[high] = containers[0]
+            elif all(c[0] == ARRAY for c in containers) and sum(c[2] for c in containers) <= ARRAY_MAX:
+                result[high] = _from_lows(sorted(set().union(*(c[1] for c in containers))))
+            else:
+                bits = 0
+                for c in containers:
+                    bits |= _to_bits(c)
+                result[high] = _from_bits(bits)
+        return self._from_containers(result)
+
+    def _pair(self, other, name):
+        bit_op, set_op = _PAIR_OPS[name]
+        mine, theirs = self._containers, other._containers
+        highs = mine.keys() if name == 'sub' else mine.keys() | theirs.keys()
+        result = {}
+        for high in highs:
+            a, b = mine.get(high), theirs.get(high)
+            if a is None or b is None:
+                result[high] = a or b
+            elif a[0] == ARRAY and b[0] == ARRAY:
+                result[high] = _from_lows(sorted(set_op(set(a[1]), b[1])))
+            else:
+                result[high] = _from_bits(bit_op(_to_bits(a), _to_bits(b)))
+        return self._from_containers(result)
+
+    def __and__(self, other):
+        if not isinstance(other, abc.Iterable):
+            return NotImplemented
+        return self.intersection(other)
+
+    def __or__(self, other):
+        if not isinstance(other, abc.Iterable):
+            return NotImplemented
+        return self.union(other)
+
+    def __sub__(self, other):
+        if not isinstance(other, abc.Iterable):
+            return NotImplemented
+        return self._pair(self._coerce(other), 'sub')
+
+    def __rsub__(self, other):
+        if not isinstance(other, abc.Iterable):
+            return NotImplemented
+        return self._coerce(other)._pair(self, 'sub')
+
+    def __xor__(self, other):
+        if not isinstance(other, abc.Iterable):
+            return NotImplemented
+        return self._pair(self._coerce(other), 'xor')
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    # 就地运算直接换上结果的容器，不像MutableSet默认实现那样逐个元素add/discard
+    def __iand__(self, other):
+        self._containers = (self & other)._containers
+        return self
+
+    def __ior__(self, other):
+        self._containers = (self | other)._containers
+        return self
+
+    def __isub__(self, other):
+        if other is self:
+            self.clear()
+        else:
+            self._containers = (self - other)._containers
+        return self
+
+    def __ixor__(self, other):
+        if other is self:
+            self.clear()
+        else:
+            self._containers = (self ^ other)._containers
+        return self
+
+    def __eq__(self, other):
+        if not isinstance(other, RoaringSet):
+            return super().__eq__(other)
+        if self._containers.keys() != other._containers.keys():
+            return False
+        return all(c[2] == other._containers[high][2] and _to_bits(c) == _to_bits(other._containers[high])
+                   for high, c in self._containers.items())
+
+    # 各容器实际占用的字节数，不含Python对象本身的开销
+    @property
+    def nbytes(self):
+        return sum(BITMAP_BYTES if kind == BITMAP else 2 * len(data)
+                   for kind, data, card in self._containers.values())
+
+    # 格式：'RSET' + 容器个数，之后每个容器是(高位, 类型, 元素数, 数据字节数) + 小端序的数据
+    def to_bytes(self):
+        chunks = [_SET_HEADER.pack(b'RSET', len(self._containers))]
+        for high in sorted(self._containers):
+            kind, data, card = self._containers[high]
+            if kind == BITMAP:
+                payload = data.to_bytes(BITMAP_BYTES, 'little')
+            else:
+                if sys.byteorder == 'big':
+                    data = array.array('H', data)
+                    data.byteswap()
+                payload = data.tobytes()
+            chunks.append(_CONTAINER_HEADER.pack(high, kind, card, len(payload)))
+            chunks.append(payload)
+        return b''.join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = memoryview(data)
+        magic, count = _SET_HEADER.unpack_from(data)
+        if magic != b'RSET':
+            raise ValueError('not a RoaringSet payload')
+        offset = _SET_HEADER.size
+        containers = {}
+        for _ in range(count):
+            high, kind, card, size = _CONTAINER_HEADER.unpack_from(data, offset)
+            offset += _CONTAINER_HEADER.size
+            payload = data[offset:offset + size]
+            offset += size
+            if kind == BITMAP:
+                value = int.from_bytes(payload, 'little')
+            else:
+                value = array.array('H', payload.tobytes())
+                if sys.byteorder == 'big':
+                    value.byteswap()
+            containers[high] = kind, value, card
+        return cls._from_containers(containers)
+
+if __name__ == '__main__':
+    evens = RoaringSet(range(0, 200000, 2))
+    block = RoaringSet(range(100000, 300000))
+    print(len(evens & block), len(evens | block), len(block - evens), 100002 in evens & block)
+    print(RoaringSet([1, 5, 70000]) | {3}, RoaringSet.from_bytes(block.to_bytes()) == block, block.nbytes)
+
+# 比较set和RoaringSet的内存占用以及求交、并、差、元素个数的耗时
+# sparse: 元素稀疏分布，容器都是ARRAY；dense: 一半的数都在集合里，容器都是BITMAP
+def bench_roaring_set(n=10**6):
+    import random
+    import time
+    import tracemalloc
+    for name, universe in (('sparse', 100 * n), ('dense', 2 * n)):
+        a_values = random.sample(range(universe), n)
+        b_values = random.sample(range(universe), n)
+        built = {}
+        for cls in (set, RoaringSet):
+            tracemalloc.start()
+            built[cls] = cls(a_values), cls(b_values)
+            used = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            timings = []
+            a, b = built[cls]
+            for op in (operator.and_, operator.or_, operator.sub, lambda x, y: len(x)):
+                t0 = time.perf_counter()
+                op(a, b)
+                timings.append((time.perf_counter() - t0) * 1e3)
+            print('%-6s %-10s: %5.1f bytes/element  and %7.1fms  or %7.1fms  sub %7.1fms  len %7.3fms'
+                  % (name, cls.__name__, used / (2 * n), *timings))
+        assert set(built[RoaringSet][0] & built[RoaringSet][1]) == built[set][0] & built[set][1]
+# bench_roaring_set()
+
 # 自python3.3开始，str, bytes和datetime对象的散列值计算过程多了随机“加盐”这一步
 # 盐值是python进程内的一个常量， 但是每次启动python解释器都会产生一个不同的盐值
 # 这是为了防止DOS攻击
@@ -143,6 +1165,267 @@ print(d_proxy[2])
 # 因散列表是稀疏的，要占有巨大的空间，因避免使用字典存放数量巨大的记录
 # 在用户自定义的类型中，__slots__属性可以改变实例属性的存储方式
 
+# 一定要存上亿条int->int或str->int的记录时，可以自己实现一个紧凑的散列表
+# CompactHashMap把所有数据放在一块连续的缓冲区里：文件头、键、（str键的）偏移、值、状态
+# 键和值都是定长的机器类型，不为每条记录创建Python对象；冲突用开放寻址解决，探测序列与dict相同
+# load_factor越小冲突越少但越占空间；删除只把状态标成DELETED，扩容时一并清理
+# 探测序列用capacity - 1做掩码，所以容量总是2的幂：传入的capacity向上取整，文件头里的容量不是2的幂就拒绝打开
+# 写入时先把键和值写进槽位（超出类型范围时在这里抛出ValueError），成功后才改状态和计数，失败不会破坏表
+# 扩容时直接从旧缓冲区的类型化视图逐个槽位复制到新缓冲区，用存好的散列值重新定位，不经过Python层面的键值对
+# str键只在键列存散列值，字符串本身以“4字节长度+utf-8”的形式追加在_arena里
+# 给出path时缓冲区是mmap映射的文件，可以关闭后再打开；这种模式只支持int键
+import mmap
+
+EMPTY, USED, DELETED = 0, 1, 2
+HEADER = struct.Struct('<QQQ')
+
+class CompactHashMap(abc.MutableMapping):
+    def __init__(self, items=(), key_type=int, value_typecode='q', load_factor=0.75, capacity=8, path=None):
+        if key_type not in (int, str):
+            raise TypeError('key_type must be int or str')
+        if not 0 < load_factor < 1:
+            raise ValueError('load_factor must be between 0 and 1')
+        if path is not None and key_type is not int:
+            raise ValueError('on-disk mode only supports int keys')
+        self.key_type = key_type
+        self.value_typecode = value_typecode
+        self.load_factor = load_factor
+        self.path = path
+        self._value_size = array.array(value_typecode).itemsize
+        self._arena = bytearray()
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as fp:
+                capacity = HEADER.unpack(fp.read(HEADER.size))[0]
+            if capacity < 1 or capacity & (capacity - 1):
+                raise ValueError('%s: corrupt header, capacity %d is not a power of 2' % (path, capacity))
+            self._attach(capacity, self._map_file(path, capacity))
+        else:
+            capacity = 1 << (max(capacity, 1) - 1).bit_length()
+            self._attach(capacity, self._new_buffer(capacity, path))
+        self.update(items)
+
+    def _layout_size(self, capacity):
+        ref_size = 8 if self.key_type is str else 0
+        return HEADER.size + capacity * (8 + ref_size + self._value_size + 1)
+
+    def _map_file(self, path, capacity):
+        with open(path, 'r+b') as fp:
+            return mmap.mmap(fp.fileno(), self._layout_size(capacity))
+
+    def _new_buffer(self, capacity, path):
+        if path is None:
+            return bytearray(self._layout_size(capacity))
+        with open(path, 'wb') as fp:
+            fp.truncate(self._layout_size(capacity))
+        return self._map_file(path, capacity)
+
+    # 在缓冲区上切出各列的类型化视图
+    def _attach(self, capacity, buf):
+        self._buf = buf
+        self._capacity = capacity
+        view = memoryview(buf)
+        offset = HEADER.size
+        self._header = view[:offset].cast('Q')
+        self._header[0] = capacity
+        self._keys = view[offset:offset + 8 * capacity].cast('q')
+        offset += 8 * capacity
+        if self.key_type is str:
+            self._refs = view[offset:offset + 8 * capacity].cast('Q')
+            offset += 8 * capacity
+        self._values = view[offset:offset + self._value_size * capacity].cast(self.value_typecode)
+        offset += self._value_size * capacity
+        self._states_offset = offset
+        self._states = view[offset:offset + capacity]
+
+    def _release(self):
+        for name in ('_header', '_keys', '_refs', '_values', '_states'):
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+
+    def __len__(self):
+        return self._header[1]
+
+    def _hash(self, key):
+        if type(key) is not self.key_type:
+            raise TypeError('expected %s key, got %r' % (self.key_type.__name__, key))
+        return hash(key) if self.key_type is str else key
+
+    def _str_key(self, i):
+        offset = self._refs[i]
+        length, = struct.unpack_from('<I', self._arena, offset)
+        return self._arena[offset + 4:offset + 4 + length].decode('utf-8')
+
+    # 返回(槽位, 是否找到)；没找到时返回可以插入的槽位（优先复用DELETED槽位）
+    def _probe(self, key, h):
+        states, keys = self._states, self._keys
+        mask = self._capacity - 1
+        perturb = h & HASH_MASK
+        i = perturb & mask
+        reuse = -1
+        while True:
+            state = states[i]
+            if state == EMPTY:
+                return (i if reuse < 0 else reuse), False
+            if state == USED:
+                if keys[i] == h and (self.key_type is int or self._str_key(i) == key):
+                    return i, True
+            elif reuse < 0:
+                reuse = i
+            perturb >>= 5
+            i = (5 * i + 1 + perturb) & mask
+
+    # 扩容时用：新表里没有重复的键，沿同样的探测序列找到第一个EMPTY槽位即可
+    def _free_slot(self, h):
+        states = self._states
+        mask = self._capacity - 1
+        perturb = h & HASH_MASK
+        i = perturb & mask
+        while states[i] != EMPTY:
+            perturb >>= 5
+            i = (5 * i + 1 + perturb) & mask
+        return i
+
+    # 类型不对的键一定不在表里，读操作按“找不到”处理，这样get和in的行为与dict一致
+    def __getitem__(self, key):
+        if type(key) is not self.key_type:
+            raise KeyError(key)
+        i, found = self._probe(key, self._hash(key))
+        if not found:
+            raise KeyError(key)
+        return self._values[i]
+
+    def __contains__(self, key):
+        if type(key) is not self.key_type:
+            return False
+        return self._probe(key, self._hash(key))[1]
+
+    def __setitem__(self, key, value):
+        h = self._hash(key)
+        i, found = self._probe(key, h)
+        if found:
+            self._values[i] = value
+            return
+        self._keys[i] = h
+        self._values[i] = value
+        if self.key_type is str:
+            data = key.encode('utf-8')
+            self._refs[i] = len(self._arena)
+            self._arena += struct.pack('<I', len(data)) + data
+        if self._states[i] == EMPTY:
+            self._header[2] += 1
+        self._states[i] = USED
+        self._header[1] += 1
+        if self._header[2] > self._capacity * self.load_factor:
+            self._resize()
+
+    def __delitem__(self, key):
+        if type(key) is not self.key_type:
+            raise KeyError(key)
+        i, found = self._probe(key, self._hash(key))
+        if not found:
+            raise KeyError(key)
+        self._states[i] = DELETED
+        self._header[1] -= 1
+
+    def __iter__(self):
+        for i in self._used_slots():
+            yield self._str_key(i) if self.key_type is str else self._keys[i]
+
+    # 直接在缓冲区（bytearray或mmap）的状态列里查找USED，不复制整列
+    def _used_slots(self, buf=None, start=None, capacity=None):
+        if buf is None:
+            buf, start, capacity = self._buf, self._states_offset, self._capacity
+        used, end = bytes([USED]), start + capacity
+        i = buf.find(used, start, end)
+        while i >= 0:
+            yield i - start
+            i = buf.find(used, i + 1, end)
+
+    # 与dict一样按已有元素数的1.5倍扩容（取2的幂），同时清理DELETED槽位和_arena中的无用字符串
+    # 旧缓冲区和它的视图一直保留到复制完成；文件模式下新表先写到临时文件，复制完再替换
+    def _resize(self):
+        count = len(self)
+        capacity = 8
+        while capacity * self.load_factor < 1.5 * count:
+            capacity *= 2
+        old_buf, old_arena = self._buf, self._arena
+        old_start, old_capacity = self._states_offset, self._capacity
+        old_views = {name: self.__dict__.pop(name) for name in ('_header', '_keys', '_refs', '_values', '_states')
+                     if name in self.__dict__}
+        old_keys, old_values, old_refs = old_views['_keys'], old_views['_values'], old_views.get('_refs')
+        self._arena = bytearray()
+        if self.path is None:
+            self._attach(capacity, self._new_buffer(capacity, None))
+        else:
+            tmp_path = self.path + '.tmp'
+            self._attach(capacity, self._new_buffer(capacity, tmp_path))
+        keys, values, states = self._keys, self._values, self._states
+        for i in self._used_slots(old_buf, old_start, old_capacity):
+            h = old_keys[i]
+            j = self._free_slot(h)
+            keys[j] = h
+            values[j] = old_values[i]
+            if old_refs is not None:
+                offset = old_refs[i]
+                length, = struct.unpack_from('<I', old_arena, offset)
+                self._refs[j] = len(self._arena)
+                self._arena += old_arena[offset:offset + 4 + length]
+            states[j] = USED
+        self._header[1] = self._header[2] = count
+        for view in old_views.values():
+            view.release()
+        if self.path is not None:
+            old_buf.close()
+            os.replace(tmp_path, self.path)
+
+    # 缓冲区和_arena一共占用的字节数（包括空槽位）
+    @property
+    def nbytes(self):
+        return len(self._buf) + len(self._arena)
+
+    def flush(self):
+        if self.path is not None:
+            self._buf.flush()
+
+    def close(self):
+        buf = self._buf
+        self._release()
+        if self.path is not None:
+            buf.flush()
+            buf.close()
+
+if __name__ == '__main__':
+    chm = CompactHashMap({1: 10, 2: 20})
+    chm[3] = 30
+    del chm[1]
+    print(isinstance(chm, abc.Mapping), dict(chm), chm.nbytes)
+    word_ids = CompactHashMap(key_type=str, value_typecode='I')
+    word_ids.update(zip(['caju', 'atemoia', 'cajá'], range(3)))
+    print(word_ids['cajá'], 'acerola' in word_ids)
+
+# 比较dict和CompactHashMap每条记录占用的字节数以及查找吞吐量
+def bench_compact_hash_map(n=10**6, path=None):
+    import random
+    import time
+    import tracemalloc
+    keys = random.sample(range(n * 10), n)
+    tracemalloc.start()
+    plain = {k: k * 2 for k in keys}
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    compact = CompactHashMap(((k, k * 2) for k in keys), path=path)
+    print('dict           : %6.1f bytes/entry' % (dict_bytes / n))
+    print('CompactHashMap : %6.1f bytes/entry' % (compact.nbytes / n))
+    for name, m in (('dict', plain), ('CompactHashMap', compact)):
+        t0 = time.perf_counter()
+        for k in keys:
+            m[k]
+        print('%-14s : %10.0f lookups/s' % (name, n / (time.perf_counter() - t0)))
+    compact.close()
+# bench_compact_hash_map()
+# bench_compact_hash_map(path='compact.bin')
+
 # python3中，keys()，items()和values()方法返回的都是字典视图
 # 视图还有动态的特性，他们可以实时反馈字典的变化
 
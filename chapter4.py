@@ -4,65 +4,67 @@
 # 把码位转换成字节序列的过程叫编码
 # 把字节序列转换成码位的过程是解码
 
-# 4个Unicode字符
-s = 'cafe'
-print(len(s))
-# 使用utf-8把str对象编码成bytes对象
-b = s.encode('utf-8')
-# bytes对象以b开头
-print(b)
-b = b.decode('utf-8')
-print(b)
-
-# python3的str类型基本相当于python2的unicode类型
-# python2.6的bytes类型，就是str类型
-# 但python3的bytes类型却不是把str类型换个名称那么简单
-
-# bytes或bytearray对象的各个元素是介于0~255（含）之间的整数
-cafe = bytes('café', encoding='utf-8')
-print(cafe)
-# cafe[0]返回一个元素
-print(cafe[0])
-# cafe[:1]返回bytes对象
-print(cafe[:1])
-# bytearray对象没有字面量句法
-cafe_arr = bytearray(cafe)
-print(cafe_arr)
-print(cafe_arr[-1:])
-
-# 特别的，对于str类型来说，s[i]返回一个元素，而s[i:i+1]返回一个相同类型的序列
-
-# 各字节的值可能会使用下列三种不同的方式显示
-# 可打印的ASCII范围内的字节
-# 制表符、换行符、回车符和对应的字节，使用转移序列\t,\n,\r和\\
-# 其他字节的值，使用十六进制转义序列。eg. \x00是空字节
-
-# 可以使用字符串方法处理二进制序列，如endswith, replace, strip等，除了有几个方法不行
-# re模块中的正则表达式函数也能处理二进制序列
-# 二进制序列有个方法是str没有的，fromhex，作用是解析十六进制数字对
-print(bytes.fromhex('31 4B CE A9'))
+if __name__ == '__main__':
+    # 4个Unicode字符
+    s = 'cafe'
+    print(len(s))
+    # 使用utf-8把str对象编码成bytes对象
+    b = s.encode('utf-8')
+    # bytes对象以b开头
+    print(b)
+    b = b.decode('utf-8')
+    print(b)
+
+    # python3的str类型基本相当于python2的unicode类型
+    # python2.6的bytes类型，就是str类型
+    # 但python3的bytes类型却不是把str类型换个名称那么简单
+
+    # bytes或bytearray对象的各个元素是介于0~255（含）之间的整数
+    cafe = bytes('café', encoding='utf-8')
+    print(cafe)
+    # cafe[0]返回一个元素
+    print(cafe[0])
+    # cafe[:1]返回bytes对象
+    print(cafe[:1])
+    # bytearray对象没有字面量句法
+    cafe_arr = bytearray(cafe)
+    print(cafe_arr)
+    print(cafe_arr[-1:])
+
+    # 特别的，对于str类型来说，s[i]返回一个元素，而s[i:i+1]返回一个相同类型的序列
+
+    # 各字节的值可能会使用下列三种不同的方式显示
+    # 可打印的ASCII范围内的字节
+    # 制表符、换行符、回车符和对应的字节，使用转移序列\t,\n,\r和\\
+    # 其他字节的值，使用十六进制转义序列。eg. \x00是空字节
+
+    # 可以使用字符串方法处理二进制序列，如endswith, replace, strip等，除了有几个方法不行
+    # re模块中的正则表达式函数也能处理二进制序列
+    # 二进制序列有个方法是str没有的，fromhex，作用是解析十六进制数字对
+    print(bytes.fromhex('31 4B CE A9'))
 
 # 使用缓冲类对象(bytes, bytearray, memoryview, array.array)构建二进制序列
 import array
-numbers = array.array('h', [-2, -1, 0, 1, 2])
-octets = bytes(numbers)
-print(octets)
-
-# 使用缓冲类对象创建bytes或bytearray，始终复制源对象中的字节序列
-# 与之相反，memoryview对象允许在二进制数据结构之间共享内存
-
-# struct模块能把打包的字节序列转换成不同类型字段组成的元组，或者反向操作
-
-# 处理UnicodeEncodeError
-city = 'São Paulo'
-# 报错，cp437无法编码ã
-# print(city.encode('cp437'))
-# 跳过无法编码的字符
-print(city.encode('cp437', errors='ignore'))
-# 把无法编码的字符替换成?
-print(city.encode('cp437', errors='replace'))
-# 把无法编码的字符替换成XML实体
-print(city.encode('cp437', errors='xmlcharrefreplace'))
+if __name__ == '__main__':
+    numbers = array.array('h', [-2, -1, 0, 1, 2])
+    octets = bytes(numbers)
+    print(octets)
+
+    # 使用缓冲类对象创建bytes或bytearray，始终复制源对象中的字节序列
+    # 与之相反，memoryview对象允许在二进制数据结构之间共享内存
+
+    # struct模块能把打包的字节序列转换成不同类型字段组成的元组，或者反向操作
+
+    # 处理UnicodeEncodeError
+    city = 'São Paulo'
+    # 报错，cp437无法编码ã
+    # print(city.encode('cp437'))
+    # 跳过无法编码的字符
+    print(city.encode('cp437', errors='ignore'))
+    # 把无法编码的字符替换成?
+    print(city.encode('cp437', errors='replace'))
+    # 把无法编码的字符替换成XML实体
+    print(city.encode('cp437', errors='xmlcharrefreplace'))
 
 # UnicodeDecodeError类似
 
@@ -86,23 +88,368 @@ print(city.encode('cp437', errors='xmlcharrefreplace'))
 # utf-8的U+FFEF字节序列是'b\xef\xbb\xbf'
 # 但python不会根据有无BOM确定文件是否为utf-8编码
 
+# 多GB的文件在不同编码之间转换时，不能read()整个文件再decode/encode，那样要占用文件大小数倍的内存
+# transcode_stream每次读入固定大小的一块（总是读进同一个bytearray，不重复分配），交给增量解码器
+# 增量解码器会把被切断的多字节序列留到下一块再解码，所以块的边界落在哪里都不会出错
+# 文件开头的BOM先识别出来并去掉，没有指定编码时用它确定编码
+# 要先判断utf-32，因为utf-32-le的BOM以utf-16-le的BOM开头
+# errors换成计数版本的错误处理器：先记下出错的字符数（解码时是字节数），再交给原来的处理器（ignore/replace/...）
+# 一次调用可能处理连续的好几个出错字符，按调用次数计数的话结果会随分块方式变化，所以按个数计
+import codecs
+import collections
+import contextvars
+import functools
+import itertools
+import os
+
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+]
+# 指定了编码时，只去掉同一族的BOM
+BOM_FAMILIES = {
+    'utf-32-le': ('utf-32', 'utf-32-le'),
+    'utf-32-be': ('utf-32', 'utf-32-be'),
+    'utf-8': ('utf-8', 'utf-8-sig'),
+    'utf-16-le': ('utf-16', 'utf-16-le'),
+    'utf-16-be': ('utf-16', 'utf-16-be'),
+}
+
+# 返回(编码, BOM的长度)
+def detect_bom(head, encoding=None):
+    family = codecs.lookup(encoding).name if encoding else None
+    for bom, name in BOMS:
+        if head.startswith(bom) and (family is None or family in BOM_FAMILIES[name]):
+            return name, len(bom)
+    if family == 'utf-8-sig':
+        return 'utf-8', 0
+    return encoding or 'utf-8', 0
+
+_error_counts = contextvars.ContextVar('error_counts', default=None)
+
+def counting_errors(errors):
+    name = 'counting_' + errors
+    try:
+        codecs.lookup_error(name)
+    except LookupError:
+        handle = codecs.lookup_error(errors)
+
+        def handler(exc):
+            counts = _error_counts.get()
+            if counts is not None:
+                side = 'decode' if isinstance(exc, UnicodeDecodeError) else 'encode'
+                counts[side + ':' + errors] += exc.end - exc.start
+            return handle(exc)
+        codecs.register_error(name, handler)
+    return name
+
+TranscodeStats = collections.namedtuple('TranscodeStats', 'encoding bom bytes_in bytes_out errors')
+
+def _transcode(src, dst, encoding, to_encoding, decode_errors, encode_errors, chunk_size, head=b'', limit=None):
+    decoder = codecs.getincrementaldecoder(encoding)(counting_errors(decode_errors))
+    encoder = codecs.getincrementalencoder(to_encoding)(counting_errors(encode_errors))
+    bytes_in = len(head)
+    bytes_out = dst.write(encoder.encode(decoder.decode(head)))
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    while limit is None or bytes_in < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - bytes_in)
+        n = src.readinto(view[:size])
+        if not n:
+            break
+        bytes_in += n
+        bytes_out += dst.write(encoder.encode(decoder.decode(view[:n])))
+    bytes_out += dst.write(encoder.encode(decoder.decode(b'', final=True), final=True))
+    return bytes_in, bytes_out
+
+def transcode_stream(src, dst, encoding=None, to_encoding='utf-8', decode_errors='strict',
+                     encode_errors='strict', chunk_size=1 << 20):
+    counts = collections.Counter()
+    token = _error_counts.set(counts)
+    try:
+        head = src.read(4)
+        encoding, bom = detect_bom(head, encoding)
+        bytes_in, bytes_out = _transcode(src, dst, encoding, to_encoding, decode_errors,
+                                         encode_errors, chunk_size, head=head[bom:])
+    finally:
+        _error_counts.reset(token)
+    return TranscodeStats(encoding, bom > 0, bytes_in + bom, bytes_out, counts)
+
+# 进程池模式：把文件按换行符切成几段，各进程分别转码到临时文件，最后按顺序拼起来
+# 换行符之后一定是一个字符的开头：ASCII兼容的多字节编码（gbk、shift_jis等）的后续字节都不会是b'\n'
+# utf-16/32的换行符还要与码元对齐；有状态的编码（iso2022、utf-7、hz）和字节序不明的utf-16/32不能这样切
+# 输出编码如果会在开头写BOM（utf-16、utf-32、utf-8-sig），每一段都会写一次，也不能用这种模式
+def _split_points(src, start, size, encoding, parts, window=1 << 16):
+    name = codecs.lookup(encoding).name
+    if name.startswith('iso2022') or name in ('utf-7', 'hz', 'utf-16', 'utf-32'):
+        raise ValueError('cannot split %s input on line boundaries' % name)
+    token = '\n'.encode(encoding)
+    unit = len(token)
+    points = [start]
+    for i in range(1, parts):
+        pos = max(start + (size - start) * i // parts, points[-1])
+        pos += (start - pos) % unit
+        src.seek(pos)
+        block = src.read(window)
+        while block:
+            j = block.find(token)
+            while j >= 0 and j % unit:
+                j = block.find(token, j + 1)
+            if j >= 0:
+                points.append(pos + j + unit)
+                break
+            pos += len(block)
+            block = src.read(window)
+        if not block:
+            break
+    if points[-1] < size or len(points) == 1:
+        points.append(size)
+    return points
+
+def _transcode_part(src_path, part_path, start, end, encoding, to_encoding, decode_errors,
+                    encode_errors, chunk_size):
+    counts = collections.Counter()
+    _error_counts.set(counts)
+    with open(src_path, 'rb') as src, open(part_path, 'wb') as dst:
+        src.seek(start)
+        bytes_in, bytes_out = _transcode(src, dst, encoding, to_encoding, decode_errors,
+                                         encode_errors, chunk_size, limit=end - start)
+    return bytes_out, counts
+
+def transcode_file(src_path, dst_path, encoding=None, to_encoding='utf-8', decode_errors='strict',
+                   encode_errors='strict', chunk_size=1 << 20, workers=1):
+    if workers == 1:
+        with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+            return transcode_stream(src, dst, encoding, to_encoding, decode_errors, encode_errors, chunk_size)
+    if codecs.lookup(to_encoding).name in ('utf-16', 'utf-32', 'utf-8-sig'):
+        raise ValueError('process mode needs an output encoding without BOM, e.g. utf-16-le')
+    workers = workers or os.cpu_count() or 1
+    with open(src_path, 'rb') as src:
+        encoding, bom = detect_bom(src.read(4), encoding)
+        size = os.fstat(src.fileno()).st_size
+        points = _split_points(src, bom, size, encoding, workers)
+    parts = ['%s.part%d' % (dst_path, i) for i in range(len(points) - 1)]
+    args = [encoding, to_encoding, decode_errors, encode_errors, chunk_size]
+    from concurrent import futures
+    with futures.ProcessPoolExecutor(workers) as executor:
+        results = list(executor.map(_transcode_part, itertools.repeat(src_path), parts, points[:-1],
+                                    points[1:], *map(itertools.repeat, args)))
+    import shutil
+    counts = collections.Counter()
+    with open(dst_path, 'wb') as dst:
+        for part, (bytes_out, part_counts) in zip(parts, results):
+            with open(part, 'rb') as fp:
+                shutil.copyfileobj(fp, dst, chunk_size)
+            os.remove(part)
+            counts.update(part_counts)
+    return TranscodeStats(encoding, bom > 0, size, sum(r[0] for r in results), counts)
+
+import io
+if __name__ == '__main__':
+    legacy = io.BytesIO(codecs.BOM_UTF16_LE + 'São Paulo\n'.encode('utf-16-le') * 3)
+    converted = io.BytesIO()
+    print(transcode_stream(legacy, converted, to_encoding='cp437', encode_errors='replace'), converted.getvalue()[:10])
+
+# 用cp1252编码、1%的行夹杂无法解码字节的文件，比较整个read().decode()与流式转码的吞吐量和峰值内存
+# 计数版本的错误处理器是Python函数，出错越频繁，与C实现的内置处理器相比就越慢
+# 进程池模式下子进程的内存不计入tracemalloc，只能看出主进程的占用
+def bench_transcode(mb=50, path='transcode_bench.txt', workers=(1, 2)):
+    import random
+    import time
+    import tracemalloc
+    line = 'Preço: 10€ — café, crème brûlée, Zürich, naïve'.encode('cp1252')
+    lines = [line[:random.randrange(10, len(line))] + b'\n' for _ in range(1000)]
+    for i in range(0, len(lines), 100):
+        lines[i] = b'\x81' + lines[i]
+    with open(path, 'wb') as fp:
+        for _ in range(mb * (1 << 20) // sum(map(len, lines)) + 1):
+            fp.writelines(lines)
+    size = os.path.getsize(path)
+
+    def whole_file():
+        with open(path, 'rb') as src, open(path + '.out', 'wb') as dst:
+            dst.write(src.read().decode('cp1252', errors='replace').encode('utf-8'))
+
+    cases = [('read().decode()', whole_file)]
+    cases += [('transcode_file(%d)' % w, lambda w=w: transcode_file(path, path + '.out', 'cp1252',
+                                                                    decode_errors='replace', workers=w))
+              for w in workers]
+    for name, run in cases:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-18s: %7.1f MB/s  peak %7.1f MB' % (name, size / elapsed / (1 << 20), peak / (1 << 20)))
+    os.remove(path)
+    os.remove(path + '.out')
+# bench_transcode()
+
+# 猜测编码：chardet要分析整个文件，很慢。sniff_encoding按代价从低到高依次尝试，命中就返回：
+# 1. 有BOM就可以确定编码
+# 2. 只取开头sample_size个字节做样本，样本里b'\x00'很多时看它们落在哪些位置：
+#    ASCII字符的utf-16-le编码高字节在奇数位置，为0；utf-16-be在偶数位置；utf-32每个码元的高两个字节都是0
+#    猜出来之后还要能严格解码样本才算数。b'\x00'也是合法的utf-8，所以这一步要在utf-8之前
+# 3. 样本能按utf-8严格解码就认为是utf-8（末尾被截断的字符不算错误），其他编码的文本几乎不可能恰好是合法的utf-8
+# 4. 最后才对样本（而不是整个文件）调用chardet；没装chardet时返回default
+# sniff_file按(路径, 修改时间, 大小)缓存结果，文件没变就不再读
+EncodingGuess = collections.namedtuple('EncodingGuess', 'encoding bom confidence method')
+
+def _is_utf8(sample):
+    try:
+        sample.decode('utf-8')
+    except UnicodeDecodeError as e:
+        return e.reason == 'unexpected end of data' and e.start >= len(sample) - 3
+    return True
+
+def _guess_from_nulls(sample):
+    if sample.count(0) < len(sample) // 10:
+        return None
+    quarter = max(len(sample) // 4, 1)
+    zeros = [sample[i::4].count(0) / quarter for i in range(4)]
+    if zeros[2] > 0.9 and zeros[3] > 0.9:
+        candidates = ['utf-32-le']
+    elif zeros[0] > 0.9 and zeros[1] > 0.9:
+        candidates = ['utf-32-be']
+    elif zeros[1] + zeros[3] > 2 * (zeros[0] + zeros[2]):
+        candidates = ['utf-16-le']
+    elif zeros[0] + zeros[2] > 2 * (zeros[1] + zeros[3]):
+        candidates = ['utf-16-be']
+    else:
+        return None
+    for encoding in candidates:
+        unit = 4 if encoding.startswith('utf-32') else 2
+        try:
+            sample[:len(sample) - len(sample) % unit].decode(encoding)
+        except UnicodeDecodeError:
+            # 样本末尾可能截断了utf-16的代理对
+            if unit == 2 and len(sample) > 4:
+                try:
+                    sample[:len(sample) - len(sample) % 2 - 2].decode(encoding)
+                except UnicodeDecodeError:
+                    continue
+            else:
+                continue
+        return encoding
+    return None
+
+def sniff_encoding(sample, default='latin-1'):
+    encoding, bom = detect_bom(sample)
+    if bom:
+        return EncodingGuess(encoding, True, 1.0, 'bom')
+    encoding = _guess_from_nulls(sample)
+    if encoding is not None:
+        return EncodingGuess(encoding, False, 0.9, 'nulls')
+    if _is_utf8(sample):
+        return EncodingGuess('utf-8', False, 1.0 if not sample.isascii() else 0.5, 'utf-8')
+    try:
+        import chardet
+    except ImportError:
+        return EncodingGuess(default, False, 0.0, 'default')
+    result = chardet.detect(sample)
+    if result['encoding'] is None:
+        return EncodingGuess(default, False, 0.0, 'default')
+    return EncodingGuess(result['encoding'].lower(), False, result['confidence'], 'chardet')
+
+SNIFF_SAMPLE_SIZE = 1 << 16
+
+@functools.lru_cache(maxsize=4096)
+def _sniff_file(path, mtime_ns, size, sample_size, default):
+    with open(path, 'rb') as fp:
+        return sniff_encoding(fp.read(sample_size), default)
+
+def sniff_file(path, sample_size=SNIFF_SAMPLE_SIZE, default='latin-1'):
+    st = os.stat(path)
+    return _sniff_file(os.path.abspath(path), st.st_mtime_ns, st.st_size, sample_size, default)
+
+if __name__ == '__main__':
+    print(sniff_encoding('El Niño'.encode('utf-16-le')), sniff_encoding(b'\xef\xbb\xbfcaf\xc3\xa9'))
+
+# 用同一批多语种文本，以各种编码（有无BOM）生成合成语料
+# 准确率按“用猜出的编码解码后与原文相同”计算；耗时比较sniff_file（首次、缓存命中）与对整个文件调用chardet
+def bench_sniff(directory='sniff_bench', repeat=200):
+    import shutil
+    import time
+    texts = {
+        'en': 'The quick brown fox jumps over the lazy dog. ' * 40,
+        'pt': 'Não há açaí nem caju na feira de São Paulo, só acerola e cajá. ' * 40,
+        'de': 'Größere Übungen für Bürger in Zürich, schöne Grüße. ' * 40,
+        'ru': 'Съешь же ещё этих мягких французских булок, да выпей чаю. ' * 40,
+        'ja': '日本語のテキストです。文字コードを推測します。' * 80,
+        'zh': '中文文本，用来测试编码侦测的准确率和速度。' * 80,
+    }
+    encodings = {
+        'en': ['ascii', 'utf-16-le', 'utf-32-be'],
+        'pt': ['utf-8', 'utf-8-sig', 'utf-16', 'cp1252'],
+        'de': ['utf-8', 'utf-16-be', 'latin-1'],
+        'ru': ['utf-8', 'koi8-r', 'cp1251', 'utf-16-le'],
+        'ja': ['utf-8', 'shift_jis', 'euc-jp', 'utf-16'],
+        'zh': ['utf-8', 'gb2312', 'gb18030', 'utf-32'],
+    }
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for lang, text in texts.items():
+        for encoding in encodings[lang]:
+            path = os.path.join(directory, '%s.%s.txt' % (lang, encoding))
+            with open(path, 'wb') as fp:
+                fp.write((text * repeat).encode(encoding))
+            files.append((path, text * repeat))
+
+    def accuracy(guesses):
+        hits = 0
+        for (path, text), guess in zip(files, guesses):
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            try:
+                hits += data.decode(guess).lstrip('\ufeff') == text
+            except (UnicodeDecodeError, LookupError):
+                pass
+        return hits / len(files)
+
+    _sniff_file.cache_clear()
+    for name in ('sniff_file (cold)', 'sniff_file (cached)'):
+        t0 = time.perf_counter()
+        guesses = [sniff_file(path).encoding for path, text in files]
+        elapsed = time.perf_counter() - t0
+        print('%-20s: %8.3fms/file  accuracy %5.1f%%' % (name, elapsed / len(files) * 1e3, accuracy(guesses) * 100))
+    try:
+        import chardet
+    except ImportError:
+        print('chardet not installed, skipping full-file chardet')
+    else:
+        t0 = time.perf_counter()
+        guesses = []
+        for path, text in files:
+            with open(path, 'rb') as fp:
+                guesses.append(chardet.detect(fp.read())['encoding'] or 'latin-1')
+        elapsed = time.perf_counter() - t0
+        print('%-20s: %8.3fms/file  accuracy %5.1f%%' % ('chardet (full file)', elapsed / len(files) * 1e3,
+                                                         accuracy(guesses) * 100))
+    shutil.rmtree(directory)
+# bench_sniff()
+
 # 如果打开文件时没有指定encoding参数，默认值由locale.getpreferredencoding()提供
 # 如果设定了PYTHONENCODING环境变量，sys.stdout/stdin/stderr的编码使用设定的值，否则，继承所在的控制台
 # 如果输入输出到重定向文件，使用locale.getpreferredencoding()
 # sys.getfilesystemencoding()用于编码文件名，若文件名为字节序列，则不经改动传给OS API
 
-s1 = 'café'
-s2 = 'cafe\u0301'
-print(s1, s2)
-print(len(s1), len(s2))
-print(s1 == s2)
-# \u0301是combining acute accent，加在e后面得到é
-# 可以使用unicodedate.normalize函数提供的Unicode规范化
-from unicodedata import normalize
-# NFC，使用最少码位构成等价的字符串
-print(len(normalize('NFC', s1)), len(normalize('NFC', s2)))
-# NFD，把组合字符分称基字符和单独的组合字符
-print(len(normalize('NFD', s1)), len(normalize('NFD', s2)))
+if __name__ == '__main__':
+    s1 = 'café'
+    s2 = 'cafe\u0301'
+    print(s1, s2)
+    print(len(s1), len(s2))
+    print(s1 == s2)
+    # \u0301是combining acute accent，加在e后面得到é
+    # 可以使用unicodedate.normalize函数提供的Unicode规范化
+    from unicodedata import normalize
+    # NFC，使用最少码位构成等价的字符串
+    print(len(normalize('NFC', s1)), len(normalize('NFC', s2)))
+    # NFD，把组合字符分称基字符和单独的组合字符
+    print(len(normalize('NFD', s1)), len(normalize('NFD', s2)))
 
 # 保存文本前，最好使用normalize清洗字符串
 
@@ -117,15 +464,17 @@ print(len(normalize('NFD', s1)), len(normalize('NFD', s2)))
 # Unicode6.3命名了110122个字符，只占了了0.11%
 
 # 极端规范化，去掉变音符号
-import unicodedata
-import string
+import sys
 def shave_marks(txt):
+    import unicodedata
     norm_txt = unicodedata.normalize('NFD', txt)
     # 过滤所有组合记号
-    shaved = ''.join(c for c in norm_txt if unicodedata.combining(c))
+    shaved = ''.join(c for c in norm_txt if not unicodedata.combining(c))
     return unicodedata.normalize('NFC', shaved)
 
 def shave_marks_latin(txt):
+    import string
+    import unicodedata
     norm_txt = unicodedata.normalize('NFD', txt)
     latin_base = False
     keepers = []
@@ -138,6 +487,85 @@ def shave_marks_latin(txt):
     shaved = ''.join(keepers)
     return unicodedata.normalize('NFC', shaved)
 
+# 大量（而且经常重复）的字符串都要去掉变音符号时，shave_marks每次都要做两次规范化，再逐个字符过滤
+# fold_text的结果与shave_marks完全相同，但分三层加速：
+# 1. 纯ASCII字符串不含任何变音符号，直接原样返回，不做规范化
+# 2. 对每个码位预先算好“NFD分解后去掉组合记号”的结果，做成str.translate用的表，只建一次
+#    组合记号本身映射成None（删掉），没有分解形式的字符不在表里，translate时保持原样
+#    NFD只会在组合记号之间重排顺序，组合记号又都被去掉了，所以逐个字符替换与整体NFD再过滤等价
+# 3. 替换后的结果通常已经是NFC（如纯ASCII），用is_normalized快速确认即可，否则再做一次NFC
+# 再在外面套一层有界的lru_cache，重复出现的字符串直接从缓存返回
+FOLD_CACHE_SIZE = 1 << 16
+
+@functools.lru_cache(maxsize=None)
+def fold_table():
+    import unicodedata
+    table = {}
+    for cp in range(sys.maxunicode + 1):
+        c = chr(cp)
+        if unicodedata.combining(c):
+            table[cp] = None
+        else:
+            norm_c = unicodedata.normalize('NFD', c)
+            if norm_c != c:
+                table[cp] = ''.join(x for x in norm_c if not unicodedata.combining(x))
+    return table
+
+@functools.lru_cache(maxsize=FOLD_CACHE_SIZE)
+def _fold_non_ascii(txt):
+    import unicodedata
+    shaved = txt.translate(fold_table())
+    if shaved.isascii() or unicodedata.is_normalized('NFC', shaved):
+        return shaved
+    return unicodedata.normalize('NFC', shaved)
+
+def fold_text(txt):
+    if txt.isascii():
+        return txt
+    return _fold_non_ascii(txt)
+
+if __name__ == '__main__':
+    print(fold_text('Ζέφυρος, Zéfiro'), fold_text('café') == shave_marks('café'))
+
+# 流式处理：逐行产出结果，workers不为1时把输入切块交给进程池，结果仍按输入顺序产出
+# 每个进程有自己的缓存；切块和进程池的执行循环用fluentpython._pool.map_chunks，同一时刻最多只有2*workers个块在池中
+from fluentpython._pool import map_chunks
+
+def _fold_chunk(lines):
+    return [fold_text(line) for line in lines]
+
+def fold_lines(lines, workers=1, chunk_size=10000):
+    if workers == 1:
+        yield from map(fold_text, lines)
+        return
+    for folded in map_chunks(_fold_chunk, lines, chunk_size, workers):
+        yield from folded
+
+# 分别在纯ASCII、Latin-1和混合文字（希腊文、韩文、组合记号）的语料上比较吞吐量
+# 语料由少量标题重复组成，模拟真实数据中大量重复的情况
+def bench_fold_text(n=10**5, distinct=1000, workers=(1, 2)):
+    import random
+    import time
+    words = {
+        'ascii': ['coffee', 'Sao', 'Paulo', 'acai', 'cotton', 'shirt', 'USB', 'cable'],
+        'latin-1': ['café', 'São', 'Paulo', 'açaí', 'Ñandú', 'crème', 'brûlée', 'Zürich'],
+        'mixed': ['Ζέφυρος', 'café', '한국어', 'Ελληνικά', 'naïve', 'Łódź', 'tiếng', 'Việt'],
+    }
+    for corpus, vocabulary in words.items():
+        titles = [' '.join(random.choices(vocabulary, k=6)) for _ in range(distinct)]
+        lines = random.choices(titles, k=n)
+        assert [fold_text(line) for line in titles] == [shave_marks(line) for line in titles]
+        cases = [('shave_marks', lambda: list(map(shave_marks, lines))),
+                 ('fold_text', lambda: list(fold_lines(lines)))]
+        cases += [('fold_lines(%d)' % w, lambda w=w: list(fold_lines(lines, workers=w)))
+                  for w in workers if w != 1]
+        for name, run in cases:
+            _fold_non_ascii.cache_clear()
+            t0 = time.perf_counter()
+            run()
+            print('%-8s %-14s: %10.0f lines/s' % (corpus, name, n / (time.perf_counter() - t0)))
+# bench_fold_text()
+
 # 不同的区域采用排序规则有所不同，葡萄牙语等很多语言按照拉丁字母表排序
 # 但重音符号和下加符对排序几乎没什么影响，如cajá视作caja
 # 在Python中，非ASCII文本的标准排序方式是使用locale.strxfrm函数
@@ -155,15 +583,144 @@ def shave_marks_latin(txt):
 # 必须知道如何拼写区域名称
 # 操作系统的制作者必须正确实现了所设的区域
 
-# 使用PyUCA进行Unicode排序
-import pyuca
-coll = pyuca.Collator()
-fruits = ['caju', 'atemoia', 'cajá', 'açaí', 'acerola']
-sorted_fruits = sorted(fruits, key=coll.sort_key)
-print(sorted_fruits)
-# pyuca只支持python3
-# 使用Collator构造方法可以定制排序方式，默认使用自带的allkeys.txt
-# 即Unicode6.3.0的Default Unicode Collation Element Table
+if __name__ == '__main__':
+    # 使用PyUCA进行Unicode排序
+    import pyuca
+    coll = pyuca.Collator()
+    fruits = ['caju', 'atemoia', 'cajá', 'açaí', 'acerola']
+    sorted_fruits = sorted(fruits, key=coll.sort_key)
+    print(sorted_fruits)
+    # pyuca只支持python3
+    # 使用Collator构造方法可以定制排序方式，默认使用自带的allkeys.txt
+    # 即Unicode6.3.0的Default Unicode Collation Element Table
+
+# Collator()每次构造都要解析allkeys.txt，是启动时间的大头；sort_key对同一个字符串也每次重算
+# load_collator把建好的Collator用pickle存到缓存文件，之后直接反序列化，不再解析文本
+# 缓存比pyuca模块旧时（升级了pyuca）自动重建；写文件时先写临时文件再替换，避免留下半个文件
+# 缓存文件损坏或来自别的版本时，反序列化可能抛出各种异常（AttributeError、ImportError、TypeError等），
+# 得到的也可能不是Collator，这些都当作缓存无效，重建
+# 注意：从缓存加载仍要重建整棵trie的所有Python对象，实测约136ms，比解析文本快，但达不到毫秒级
+# 反序列化pickle可以执行任意代码，所以缓存放在每个用户自己的目录（$XDG_CACHE_HOME或~/.cache下，权限0700），
+# 不放在共享的临时目录；读之前检查目录和文件都属于当前用户、不是符号链接、组和其他人不可写，否则不读也不写缓存
+# 排序键统一编码成bytes：pyuca的权重都是16位整数，按大端序打包后，bytes的比较结果与元组相同
+# 而比较bytes只需一次memcmp，比逐个比较元组里的int快，占用内存也更少
+# 后端就是“str -> bytes”的函数，locale.strxfrm也可以作为后端，make_sort_key再给它套上lru_cache
+import stat
+
+COLLATOR_CACHE_NAME = 'pyuca_collator.pickle'
+
+def collator_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'fluentpython')
+
+def _is_private(st):
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def _private_dir(path):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and _is_private(st)
+
+def load_collator(cache_path=None):
+    import pickle
+    import pyuca
+    if cache_path is None:
+        cache_dir = collator_cache_dir()
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        cache_path = os.path.join(cache_dir, COLLATOR_CACHE_NAME)
+    cache_dir = os.path.dirname(os.path.abspath(cache_path))
+    if not _private_dir(cache_dir):
+        return pyuca.Collator()
+    try:
+        fd = os.open(cache_path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        pass
+    else:
+        with open(fd, 'rb') as fp:
+            st = os.fstat(fd)
+            if (stat.S_ISREG(st.st_mode) and _is_private(st)
+                    and st.st_mtime >= os.path.getmtime(pyuca.__file__)):
+                try:
+                    collator = pickle.load(fp)
+                except Exception:
+                    collator = None
+                if isinstance(collator, pyuca.Collator):
+                    return collator
+    collator = pyuca.Collator()
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+    with open(fd, 'wb') as fp:
+        pickle.dump(collator, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    return collator
+
+def weights_to_bytes(weights):
+    packed = array.array('H', weights)
+    if sys.byteorder == 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+def pyuca_backend(collator=None):
+    sort_key = (collator or load_collator()).sort_key
+    return lambda s: weights_to_bytes(sort_key(s))
+
+# strxfrm的结果按码位比较，utf-8编码后按字节比较的顺序与码位顺序一致
+def locale_backend():
+    import locale
+    return lambda s: locale.strxfrm(s).encode('utf-8', 'surrogatepass')
+
+def make_sort_key(backend=None, maxsize=1 << 16):
+    return functools.lru_cache(maxsize=maxsize)(backend or pyuca_backend())
+
+# 每个不同的字符串只算一次键，再按bytes键排序；重复越多省得越多
+# strings要遍历两次，先转成列表，传入生成器也没问题
+def collate_sort(strings, backend=None, reverse=False):
+    strings = list(strings)
+    key = backend or pyuca_backend()
+    keys = {s: key(s) for s in dict.fromkeys(strings)}
+    return sorted(strings, key=keys.__getitem__, reverse=reverse)
+
+if __name__ == '__main__':
+    print(collate_sort(fruits, pyuca_backend(coll)))
+
+# 启动时间：直接构造Collator和从缓存加载；排序吞吐量：原始sort_key、带缓存的键、collate_sort和locale后端
+def bench_collation(n=10**5, distinct=1000, locale_name='pt_BR.UTF-8'):
+    import locale
+    import random
+    import time
+    import pyuca
+    t0 = time.perf_counter()
+    pyuca.Collator()
+    t1 = time.perf_counter()
+    load_collator()
+    t2 = time.perf_counter()
+    collator = load_collator()
+    t3 = time.perf_counter()
+    print('Collator()            : %8.1fms' % ((t1 - t0) * 1e3))
+    print('load_collator() (cold): %8.1fms' % ((t2 - t1) * 1e3))
+    print('load_collator() (warm): %8.1fms' % ((t3 - t2) * 1e3))
+
+    syllables = ['ca', 'já', 'çaí', 'ju', 'a', 'te', 'mói', 'ce', 'ro', 'lá', 'ão']
+    vocabulary = [''.join(random.choices(syllables, k=4)) for _ in range(distinct)]
+    words = random.choices(vocabulary, k=n)
+    backend = pyuca_backend(collator)
+    cases = [('sorted(sort_key)', lambda: sorted(words, key=collator.sort_key)),
+             ('sorted(make_sort_key)', lambda: sorted(words, key=make_sort_key(backend))),
+             ('collate_sort', lambda: collate_sort(words, backend))]
+    try:
+        locale.setlocale(locale.LC_COLLATE, locale_name)
+        cases.append(('collate_sort(locale)', lambda: collate_sort(words, locale_backend())))
+    except locale.Error:
+        print('locale %s not available, skipping locale backend' % locale_name)
+    for name, run in cases:
+        t0 = time.perf_counter()
+        run()
+        print('%-22s: %10.0f words/s' % (name, n / (time.perf_counter() - t0)))
+# bench_collation()
 
 # Unicode标准提供了一个完整的数据库，不仅包括码位与字符名称之间的映射
 # 还有各个字符的元数据，以及字符之间的关系
@@ -176,27 +733,164 @@ print(sorted_fruits)
 # 支持字符串和字符序列的双模式API
 # 然后根据类型展现不同的行为，re和os中就有这样的函数
 
-import re
-# 字符串模式
-re_numbers_str = re.compile(r'\d+')
-re_words_str = re.compile(r'\w+')
-# 字节序列模式
-re_numbers_bytes = re.compile(rb'\d+')
-re_words_bytes = re.compile(rb'\w+')
-
-# 泰达米尔数字
-text_str = ("Ramanujan saw \u0be7\u0bed\u0be8\u0bef"
-            " as 1729 = 1³ + 12³ = 9³ + 10³.")
-text_bytes = text_str.encode('utf-8')
-print('Text', repr(text_str), sep='\n  ')
-print('Numbers')
-# 可以匹配泰达米尔数字和ASCII数字
-print('  str  :', re_numbers_str.findall(text_str))
-# 只能匹配ASCII数字
-print('  bytes  :', re_numbers_bytes.findall(text_bytes))
-print('Words')
-print('  str  :', re_words_str.findall(text_str))
-print('  bytes  :', re_words_bytes.findall(text_bytes))
+if __name__ == '__main__':
+    import re
+    # 字符串模式
+    re_numbers_str = re.compile(r'\d+')
+    re_words_str = re.compile(r'\w+')
+    # 字节序列模式
+    re_numbers_bytes = re.compile(rb'\d+')
+    re_words_bytes = re.compile(rb'\w+')
+
+    # 泰达米尔数字
+    text_str = ("Ramanujan saw \u0be7\u0bed\u0be8\u0bef"
+                " as 1729 = 1³ + 12³ = 9³ + 10³.")
+    text_bytes = text_str.encode('utf-8')
+    print('Text', repr(text_str), sep='\n  ')
+    print('Numbers')
+    # 可以匹配泰达米尔数字和ASCII数字
+    print('  str  :', re_numbers_str.findall(text_str))
+    # 只能匹配ASCII数字
+    print('  bytes  :', re_numbers_bytes.findall(text_bytes))
+    print('Words')
+    print('  str  :', re_words_str.findall(text_str))
+    print('  bytes  :', re_words_bytes.findall(text_bytes))
+
+# 同一段文本要用几十个模式扫描时，先逐行解码再分别调用findall，文本要被解码一次、扫描几十次
+# PatternScanner把所有模式拼成一个交替模式(p1)|(p2)|...，str和bytes各编译一份，扫描一遍就能找出所有模式的匹配
+# 和re的双模式API一样，按传入数据的类型选择版本：str按Unicode语义（\d能匹配泰米尔数字），bytes只认ASCII
+# 模式里的非ASCII字面量按encoding编码后在bytes中照样能匹配，但\w、\d和字符类只按ASCII处理
+# bytes版本可以直接扫描mmap映射的文件（re接受任何缓冲类对象），不用先解码；只有调用text()时才解码匹配到的那一段
+# 注意：交替模式在每个位置按给出的顺序尝试各个模式，先匹配上的获胜，这与分别findall不同：
+# 不同模式的匹配互相重叠时，只保留最先开始（同一位置时排在前面）的那个
+# 外层包装的分组最后闭合，所以Match.lastindex就是包装分组的编号，由此知道匹配的是哪个模式
+# 包装会让各模式自己的分组编号整体后移，所以模式里的编号反向引用\N和条件(?(N)...)要按偏移量改写
+# （八进制转义和字符类里的内容原样保留）；改写后超过\99的反向引用re不支持，直接报ValueError
+# 命名分组在合并后的模式里也必须唯一，不同模式用了同名分组时同样报ValueError，指出是哪两个模式
+# re.UNICODE只对str模式有意义（本来就是默认值），bytes模式不接受它，编译bytes版本时去掉这个标志
+# scan与finditer一样是惰性的，产出(模式名, Match)；Match引用着原来的缓冲区，mmap关闭之前要先释放它们
+_GROUP_REFS = r'''\\(?:0[0-7]{0,2}|[0-7]{3})|\\([1-9][0-9]?)|\\.|\[\^?\]?(?:\\.|[^\]\\])*\]|\(\?\((\d+)\)'''
+
+def _shift_group_refs(name, source, offset):
+    import re
+
+    def shift(m):
+        ref, cond = m.groups()
+        if cond is not None:
+            return '(?(%d)' % (int(cond) + offset)
+        if ref is None:
+            return m.group()
+        group = int(ref) + offset
+        if group > 99:
+            raise ValueError('pattern %r: backreference \\%s becomes \\%d in the combined pattern, '
+                             'but re only supports \\1 to \\99' % (name, ref, group))
+        return '(?:\\%d)' % group
+
+    return re.sub(_GROUP_REFS, shift, source, flags=re.DOTALL)
+
+class PatternScanner:
+    def __init__(self, patterns, flags=0, encoding='utf-8'):
+        import re
+        self.encoding = encoding
+        self.names = {}
+        sources = []
+        group_names = {}
+        group = 1
+        for name, source in dict(patterns).items():
+            regex = re.compile(source, flags)
+            for group_name in regex.groupindex:
+                if group_name in group_names:
+                    raise ValueError('patterns %r and %r both define the group name %r'
+                                     % (group_names[group_name], name, group_name))
+                group_names[group_name] = name
+            self.names[group] = name
+            sources.append('(%s)' % _shift_group_refs(name, source, group))
+            group += 1 + regex.groups
+        combined = '|'.join(sources)
+        self._str = re.compile(combined, flags)
+        self._bytes = re.compile(combined.encode(encoding), flags & ~re.UNICODE)
+
+    def scan(self, data, pos=0, endpos=sys.maxsize):
+        regex = self._str if isinstance(data, str) else self._bytes
+        names = self.names
+        return ((names[m.lastindex], m) for m in regex.finditer(data, pos, endpos))
+
+    def text(self, match):
+        value = match.group()
+        return value if isinstance(value, str) else value.decode(self.encoding, errors='replace')
+
+    def findall(self, data):
+        found = {name: [] for name in self.names.values()}
+        for name, m in self.scan(data):
+            found[name].append(m.group())
+        return found
+
+if __name__ == '__main__':
+    scanner = PatternScanner({'number': r'\d+', 'cube': '³'})
+    print('  str  :', scanner.findall(text_str))
+    print('  bytes  :', scanner.findall(text_bytes))
+
+# 日志的每一行都要匹配二十几个模式（大部分很少出现）：逐行解码后分别findall，与对整块bytes只扫描一遍相比
+# 这些模式都以各自的前缀开头，不会互相重叠；err里的非ASCII字符由[^"]逐字节匹配，解码后与str的结果相同
+def bench_scanner(n=10**5):
+    import random
+    import re
+    import time
+    patterns = {
+        'timestamp': r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}',
+        'level': r'\b(?:DEBUG|INFO|WARN|ERROR)\b',
+        'user': r'user=\w+',
+        'ip': r'ip=\d{1,3}(?:\.\d{1,3}){3}',
+        'status': r'status=\d{3}',
+        'latency': r'latency=\d+ms',
+        'path': r'path=/[\w/]*',
+        'email': r'mail=[\w.]+@[\w.]+',
+        'uuid': r'id=[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}',
+        'error': r'err="[^"]*"',
+        'bytes': r'size=\d+[kKmM]?B',
+        'method': r'\b(?:GET|POST|PUT|DELETE)\b',
+        'trace': r'trace=[0-9a-f]{16}',
+        'retry': r'retry=\d+',
+        'host': r'host=[\w.-]+',
+        'port': r'port=\d+',
+        'session': r'sid=[A-Za-z0-9]{24}',
+        'version': r'ver=\d+\.\d+\.\d+',
+        'region': r'region=[a-z]{2}-[a-z]+-\d',
+        'tenant': r'tenant=\d+',
+        'query': r'q="[^"]*"',
+        'referer': r'ref=https?://[^\s]+',
+        'agent': r'ua="[^"]*"',
+        'pid': r'pid=\d+',
+    }
+    users = ['alice', 'bob', 'carol', 'dave']
+    lines = []
+    for _ in range(n):
+        line = '2024-01-%02dT%02d:%02d:%02d %s %s user=%s ip=10.0.%d.%d status=%d latency=%dms path=/api/v1/items' % (
+            random.randint(1, 28), random.randrange(24), random.randrange(60), random.randrange(60),
+            random.choice(['INFO', 'WARN', 'ERROR']), random.choice(['GET', 'POST']), random.choice(users),
+            random.randrange(256), random.randrange(256), random.choice([200, 404, 500]), random.randrange(1000))
+        if random.random() < 0.1:
+            line += ' err="tempo esgotado às %dh"' % random.randrange(24)
+        lines.append(line.encode('utf-8'))
+    data = b'\n'.join(lines)
+    compiled = {name: re.compile(source) for name, source in patterns.items()}
+
+    t0 = time.perf_counter()
+    separate = {name: [] for name in patterns}
+    for line in data.splitlines():
+        text = line.decode('utf-8')
+        for name, regex in compiled.items():
+            separate[name].extend(regex.findall(text))
+    t1 = time.perf_counter()
+    scanner = PatternScanner(patterns)
+    combined = {name: [] for name in patterns}
+    for name, m in scanner.scan(data):
+        combined[name].append(scanner.text(m))
+    t2 = time.perf_counter()
+    assert combined == separate
+    print('decode + %d findall : %10.0f lines/s' % (len(patterns), n / (t1 - t0)))
+    print('PatternScanner.scan : %10.0f lines/s' % (n / (t2 - t1)))
+# bench_scanner()
 
 # 对于os也有类似的函数
 # os.listdir('.')返回字符串
@@ -5,39 +5,40 @@ def factorial(n):
     return 1 if n < 2 else n * factorial(n-1)
 fact = factorial
 
-# 接受函数为参数，或者把函数作为结果返回的函数是高阶函数
-# 如map，sorted等
+if __name__ == '__main__':
+    # 接受函数为参数，或者把函数作为结果返回的函数是高阶函数
+    # 如map，sorted等
 
-# 可以用列表推导和生成器表达式代替map和filter
-print(list(map(fact, range(6))))
-print([fact(i) for i in range(6)])
-print(list(map(factorial, filter(lambda n: n % 2, range(6)))))
-print([fact(i) for i in range(6) if i % 2])
+    # 可以用列表推导和生成器表达式代替map和filter
+    print(list(map(fact, range(6))))
+    print([fact(i) for i in range(6)])
+    print(list(map(factorial, filter(lambda n: n % 2, range(6)))))
+    print([fact(i) for i in range(6) if i % 2])
 
-# all(iterable) 如果iterable的每个元素都是真值，返回True; all([])返回True
-# any(iterable) 如果iterable中有一个元素是真值，返回True; any([])返回False
+    # all(iterable) 如果iterable的每个元素都是真值，返回True; all([])返回True
+    # any(iterable) 如果iterable中有一个元素是真值，返回True; any([])返回False
 
-# lambda函数的定义体只能使用纯表达式，即不能复制，不能使用while和try等语句
-fruits = ['strawberry', 'fig', 'apple', 'cherry', 'raspberry', 'banana']
-print(sorted(fruits, key=lambda word: word[::-1]))
+    # lambda函数的定义体只能使用纯表达式，即不能复制，不能使用while和try等语句
+    fruits = ['strawberry', 'fig', 'apple', 'cherry', 'raspberry', 'banana']
+    print(sorted(fruits, key=lambda word: word[::-1]))
 
-# 判断对象是否可调用，可以使用callable()
+    # 判断对象是否可调用，可以使用callable()
 
-# 函数内省
-# 函数对象还有很多属性，使用dir查看
-print(dir(factorial))
-# 大多属性为python对象共有
+    # 函数内省
+    # 函数对象还有很多属性，使用dir查看
+    print(dir(factorial))
+    # 大多属性为python对象共有
 
-# 函数使用__dict__属性存储赋予它的用户属性，这种做法不太常见
-def upper_case_name(obj):
-    return ("%s %s" % (obj.first_name, obj.last_name)).upper()
-upper_case_name.short_description = 'Custom name'
+    # 函数使用__dict__属性存储赋予它的用户属性，这种做法不太常见
+    def upper_case_name(obj):
+        return ("%s %s" % (obj.first_name, obj.last_name)).upper()
+    upper_case_name.short_description = 'Custom name'
 
-# 列出常规对象没有而函数有的属性
-class C: pass
-obj = C()
-def func(): pass
-print(sorted(set(dir(func)) - set(dir(obj))))
+    # 列出常规对象没有而函数有的属性
+    class C: pass
+    obj = C()
+    def func(): pass
+    print(sorted(set(dir(func)) - set(dir(obj))))
 
 # 从定位参数到仅限关键字参数
 def tag(name, *content, cls=None, **attrs):
@@ -53,14 +54,90 @@ def tag(name, *content, cls=None, **attrs):
     else:
         return '<%s%s />' % (name, attr_str)
 
-print(tag('br'))
-print(tag('p', 'hello'))
-print(tag('p', 'hello', 'world'))
-print(tag('p', 'hello', id=33))
-print(tag('p', 'hello', 'world', cls='sidebar'))
-print(tag(content='testing', name='img'))
-my_tag = {'name': 'img', 'title': 'Sunset Boulevard', 'src': 'sunset.jpg', 'cls': 'framed'}
-print(tag(**my_tag))
+if __name__ == '__main__':
+    print(tag('br'))
+    print(tag('p', 'hello'))
+    print(tag('p', 'hello', 'world'))
+    print(tag('p', 'hello', id=33))
+    print(tag('p', 'hello', 'world', cls='sidebar'))
+    print(tag(content='testing', name='img'))
+    my_tag = {'name': 'img', 'title': 'Sunset Boulevard', 'src': 'sunset.jpg', 'cls': 'framed'}
+    print(tag(**my_tag))
+
+# 同样的标签名和属性要渲染成千上万次时，tag每次都要排序属性、重新格式化属性字符串
+# render_tag把(name, attrs)编译成模板：开标签、闭标签和自闭合标签三段字符串，用lru_cache缓存
+# 之后每次调用只需把内容转义后拼进去；属性按插入顺序作缓存键，不用排序
+# 缓存键里存的是格式化后的str(value)而不是值本身，否则1 == 1.0 == True会命中同一个模板，渲染出别的值
+# 与tag不同的是内容和属性值都会做HTML转义（内容不转义引号），不含特殊字符时结果与tag完全相同
+# render_many把同一个标签的大量内容直接写进文件对象（如io.StringIO），结果等同于tag(name, *contents)
+# 每次只把一块内容拼成字符串写出去，不在内存中拼出完整结果
+# 内容转义等同于html.escape(c, quote=False)，直接写成三次replace；只有编译模板时才导入html（它会连带导入re）
+import itertools
+from functools import lru_cache
+
+RENDER_CHUNK = 1024
+
+@lru_cache(maxsize=4096)
+def _compile_tag(name, attr_items):
+    import html
+    attr_str = ''.join(' %s="%s"' % (attr, html.escape(value)) for attr, value in sorted(attr_items))
+    return '<%s%s>' % (name, attr_str), '</%s>' % name, '<%s%s />' % (name, attr_str)
+
+def _tag_template(name, cls, attrs):
+    if cls is not None:
+        attrs['class'] = cls
+    return _compile_tag(name, tuple((attr, str(value)) for attr, value in attrs.items()))
+
+def _escape_content(c):
+    if not isinstance(c, str):
+        c = str(c)
+    return c.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def render_tag(name, *content, cls=None, **attrs):
+    open_tag, close_tag, empty_tag = _tag_template(name, cls, attrs)
+    if not content:
+        return empty_tag
+    if len(content) == 1:
+        return open_tag + _escape_content(content[0]) + close_tag
+    return open_tag + (close_tag + '\n' + open_tag).join(map(_escape_content, content)) + close_tag
+
+def render_many(out, name, contents, cls=None, **attrs):
+    open_tag, close_tag, empty_tag = _tag_template(name, cls, attrs)
+    sep = close_tag + '\n' + open_tag
+    escaped = map(_escape_content, contents)
+    chunk = list(itertools.islice(escaped, RENDER_CHUNK))
+    if not chunk:
+        out.write(empty_tag)
+        return
+    out.write(open_tag)
+    while chunk:
+        out.write(sep.join(chunk))
+        chunk = list(itertools.islice(escaped, RENDER_CHUNK))
+        if chunk:
+            out.write(sep)
+    out.write(close_tag)
+
+if __name__ == '__main__':
+    print(render_tag('p', 'hello', 'world', cls='sidebar') == tag('p', 'hello', 'world', cls='sidebar'))
+    print(render_tag('p', '1 < 2 & 3', title='"quoted"'))
+
+# 比较tag、render_tag和render_many渲染大量同名同属性标签的吞吐量
+def bench_tag(n=10**6):
+    import io
+    import time
+    words = ['hello', 'world', 'sunset', 'boulevard'] * (n // 4)
+    attrs = {'id': 33, 'title': 'Sunset Boulevard', 'src': 'sunset.jpg'}
+    cases = [
+        ('tag', lambda: [tag('p', w, cls='sidebar', **attrs) for w in words]),
+        ('render_tag', lambda: [render_tag('p', w, cls='sidebar', **attrs) for w in words]),
+        ('tag(*words)', lambda: tag('p', *words, cls='sidebar', **attrs)),
+        ('render_many', lambda: render_many(io.StringIO(), 'p', words, cls='sidebar', **attrs)),
+    ]
+    for name, run in cases:
+        t0 = time.perf_counter()
+        run()
+        print('%-12s: %10.0f tags/s' % (name, len(words) / (time.perf_counter() - t0)))
+# bench_tag()
 
 # 装饰器可以把一个普通函数与框架的请求处理机制结合起来，如果一个函数需要一个person参数
 # 则可以从请求中获取那个名称对应的参数，那请求框架怎么知道函数需要哪个参数呢？
@@ -68,23 +145,127 @@ print(tag(**my_tag))
 # 仅限关键字参数的默认值在__kwdefaults__属性中
 # 参数的名称在__code__属性中
 
-# 可以用inspect提取函数的签名，即获取函数参数的信息
-from inspect import signature
-sig = signature(tag)
-print(sig)
-print(str(sig))
-for name, param in sig.parameters.items():
-    print(param.kind, ':', name, param.default)
+if __name__ == '__main__':
+    # 可以用inspect提取函数的签名，即获取函数参数的信息
+    from inspect import signature
+    sig = signature(tag)
+    print(sig)
+    print(str(sig))
+    for name, param in sig.parameters.items():
+        print(param.kind, ':', name, param.default)
 
-# inspect._empty表示没有默认值
-# 可以使用bind方法把任意个参数绑定到签名中的形参上
+    # inspect._empty表示没有默认值
+    # 可以使用bind方法把任意个参数绑定到签名中的形参上
 
-bound_args = sig.bind(**my_tag)
-for name, value in bound_args.arguments.items():
-    print(name, '=', value)
+    bound_args = sig.bind(**my_tag)
+    for name, value in bound_args.arguments.items():
+        print(name, '=', value)
 
 # 如果删除my_tag中其中一个值，则bind()方法会报错，缺失了相关值
 
+# signature()要分析函数对象，bind()要在Python层面逐个参数匹配，请求路由每次都调用它们代价很高
+# compile_binder对每个函数只取一次签名，再生成一个参数列表与原函数相同的函数，由解释器（C代码）完成参数匹配：
+# 定位参数、*content、仅限关键字参数和**attrs都照原样声明；有默认值的参数默认值换成哨符，
+# 这样就能知道哪些参数没有传入，与bind一样不把默认值放进arguments（需要时调用apply_defaults）
+# 生成的函数不带注解，注解不会被求值；原函数的__annotations__复制到binder上
+# 解释器的TypeError信息与bind不同，所以只要快速路径出错就改用sig.bind重新绑定，抛出的TypeError与bind完全一样
+# 仅限位置参数以关键字传入时，有**kwargs的函数调用时会把它放进kwargs，bind却会报错，这种情况也交给bind
+class _BindMissing:
+    def __repr__(self):
+        return '__bind_missing__'
+
+_BIND_MISSING = _BindMissing()
+
+def _binder_source(sig):
+    params = [p.replace(annotation=p.empty,
+                        default=p.empty if p.default is p.empty else _BIND_MISSING)
+              for p in sig.parameters.values()]
+    arglist = str(sig.replace(parameters=params, return_annotation=sig.empty))
+    lines = ['def bind%s:' % arglist]
+    var_keyword = [p.name for p in params if p.kind == p.VAR_KEYWORD]
+    positional_only = tuple(p.name for p in params if p.kind == p.POSITIONAL_ONLY)
+    if var_keyword and positional_only:
+        lines.append('    if not %s.keys().isdisjoint(%r): raise TypeError' % (var_keyword[0], positional_only))
+    lines.append('    __arguments = {}')
+    for p in params:
+        if p.kind in (p.VAR_POSITIONAL, p.VAR_KEYWORD):
+            lines.append('    if %s: __arguments[%r] = %s' % (p.name, p.name, p.name))
+        elif p.default is not p.empty:
+            lines.append('    if %s is not __bind_missing__: __arguments[%r] = %s' % (p.name, p.name, p.name))
+        else:
+            lines.append('    __arguments[%r] = %s' % (p.name, p.name))
+    lines.append('    return __arguments')
+    return '\n'.join(lines)
+
+@lru_cache(maxsize=1024)
+def compile_binder(func):
+    import inspect
+    sig = inspect.signature(func)
+    namespace = {'__bind_missing__': _BIND_MISSING}
+    exec(_binder_source(sig), namespace)
+    fast_bind = namespace['bind']
+
+    def bind(*args, **kwargs):
+        try:
+            arguments = fast_bind(*args, **kwargs)
+        except TypeError:
+            return sig.bind(*args, **kwargs)
+        return inspect.BoundArguments(sig, arguments)
+
+    bind.signature = sig
+    bind.__annotations__ = dict(getattr(func, '__annotations__', {}))
+    return bind
+
+if __name__ == '__main__':
+    bound_args = compile_binder(tag)(**my_tag)
+    print(bound_args.arguments == sig.bind(**my_tag).arguments, bound_args)
+
+# 按名称分发请求：注册时编译好binder，并记下处理函数接受哪些参数名（有**kwargs时全部接受）
+# 请求参数中多余的名称先去掉，再按bind的规则检查，检查通过后直接用这些参数调用处理函数
+class Dispatcher:
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, func=None, *, name=None):
+        if func is None:
+            return lambda f: self.register(f, name=name)
+        binder = compile_binder(func)
+        params = binder.signature.parameters.values()
+        if any(p.kind == p.VAR_KEYWORD for p in params):
+            accepted = None
+        else:
+            accepted = frozenset(p.name for p in params if p.kind != p.VAR_POSITIONAL)
+        self.handlers[name or func.__name__] = func, binder, accepted
+        return func
+
+    def dispatch(self, name, params):
+        func, binder, accepted = self.handlers[name]
+        if accepted is not None:
+            params = {key: value for key, value in params.items() if key in accepted}
+        binder(**params)
+        return func(**params)
+
+# 比较每次调用signature(f).bind、缓存签名后的sig.bind、compile_binder和Dispatcher.dispatch的耗时
+def bench_bind(n=10**5):
+    import inspect
+    import timeit
+    params = {'name': 'img', 'title': 'Sunset Boulevard', 'src': 'sunset.jpg', 'cls': 'framed'}
+    sig = inspect.signature(tag)
+    binder = compile_binder(tag)
+    router = Dispatcher()
+    router.register(tag)
+    router.register(clip)
+    cases = [
+        ('signature(tag).bind', lambda: inspect.signature(tag).bind(**params)),
+        ('sig.bind', lambda: sig.bind(**params)),
+        ('compile_binder', lambda: binder(**params)),
+        ('dispatch(tag)', lambda: router.dispatch('tag', params)),
+        ('dispatch(clip)', lambda: router.dispatch('clip', {'text': 'banana split', 'max_len': 5, 'x': 1})),
+    ]
+    for name, call in cases:
+        print('%-20s: %8.0fns/call' % (name, timeit.timeit(call, number=n) / n * 1e9))
+# bench_bind()
+
 # 函数注解
 def clip(text:str, max_len:'int > 0'=80) -> str:
     """
@@ -106,6 +287,114 @@ def clip(text:str, max_len:'int > 0'=80) -> str:
         end = len(text)
     return text[:end].rstrip()
 
+# 要截断大量文本时，clip每个字符串都要一次Python函数调用
+# clip_many把输入按块取出，在同一个循环里完成两次rfind、切片和rstrip，逐个产出结果，与clip的结果相同
+# 同一批输入要么都是str，要么都是bytes
+# 输入是bytes（例如以二进制方式读出的utf-8文本）时不用解码：空格字节不会出现在多字节字符的中间，
+# 所以在空格处截断不会切坏字符；此时max_len按字节计，rstrip只去掉ASCII空白
+# width=True时max_len按显示宽度计：东亚宽字符占2列，组合记号等零宽字符占0列，其余占1列，每个字符的宽度查过一次就记在字典里
+# 先用累计宽度找出最多能放下的字符数，再按clip的规则找空格；字符都只占1列时结果与clip相同
+# 显示宽度只对str有意义（bytes的编码未知），width=True时传入bytes会报ValueError，要先解码
+# clip_file逐块读入文件（文本或二进制方式打开都可以，width=True时只能用文本方式），每一行单独截断后写到另一个文件
+import bisect
+import operator
+
+CLIP_CHUNK = 4096
+
+def char_width(c):
+    import unicodedata
+    if unicodedata.combining(c) or unicodedata.category(c) in ('Mn', 'Me', 'Cf'):
+        return 0
+    return 2 if unicodedata.east_asian_width(c) in ('W', 'F') else 1
+
+class _WidthTable(dict):
+    def __missing__(self, c):
+        self[c] = width = char_width(c)
+        return width
+
+_char_widths = _WidthTable()
+
+def _clip_chunk(chunk, max_len):
+    clipped = []
+    append = clipped.append
+    space = b' ' if chunk and isinstance(chunk[0], bytes) else ' '
+    for text in chunk:
+        if len(text) > max_len:
+            end = text.rfind(space, 0, max_len)
+            if end < 0:
+                end = text.rfind(space, max_len)
+            if end >= 0:
+                text = text[:end]
+        append(text.rstrip())
+    return clipped
+
+def clip_width(text, max_len=80):
+    if text.isascii():
+        return clip(text, max_len)
+    widths = list(itertools.accumulate(map(_char_widths.__getitem__, text)))
+    if widths[-1] <= max_len:
+        return text.rstrip()
+    fit = bisect.bisect_right(widths, max_len)
+    end = text.rfind(' ', 0, fit)
+    if end < 0:
+        end = text.rfind(' ', fit)
+    if end >= 0:
+        text = text[:end]
+    return text.rstrip()
+
+def clip_many(texts, max_len=80, width=False):
+    it = iter(texts)
+    chunk = list(itertools.islice(it, CLIP_CHUNK))
+    while chunk:
+        if width:
+            if isinstance(chunk[0], bytes):
+                raise ValueError('width=True needs str texts: display width is not defined for bytes, decode them first')
+            yield from map(clip_width, chunk, itertools.repeat(max_len))
+        else:
+            yield from _clip_chunk(chunk, max_len)
+        chunk = list(itertools.islice(it, CLIP_CHUNK))
+
+def clip_file(src, dst, max_len=80, width=False, chunk_bytes=1 << 20):
+    lines = src.readlines(chunk_bytes)
+    binary = bool(lines) and isinstance(lines[0], bytes)
+    if binary and width:
+        raise ValueError('width=True needs a file opened in text mode')
+    newline, line_end = (b'\n', b'\r\n') if binary else ('\n', '\r\n')
+    while lines:
+        texts = map(operator.methodcaller('rstrip', line_end), lines)
+        dst.write(newline.join(clip_many(texts, max_len, width)))
+        dst.write(newline)
+        lines = src.readlines(chunk_bytes)
+
+if __name__ == '__main__':
+    print(list(clip_many(['banana split', 'banana'], 5)), list(clip_many([b'banana split'], 5)), clip_width('日本語 テキスト', 8))
+
+# 语料：长度在20到300个字符之间、由常见单词组成的商品描述，比较逐个调用clip与clip_many的吞吐量
+def bench_clip(n=10**6, max_len=80):
+    import io
+    import random
+    import time
+    words = ['durable', 'cotton', 'shirt', 'with', 'long', 'sleeves', 'and', 'a', 'classic', 'collar',
+             'machine-washable', 'available', 'in', 'several', 'colours', 'for', 'everyday', 'wear']
+    texts = [' '.join(random.choices(words, k=random.randint(3, 40))) for _ in range(n)]
+    texts_bytes = [text.encode('utf-8') for text in texts]
+    cjk = ['商品', '説明', 'テキスト', 'café', 'naïve'] + words
+    texts_cjk = [' '.join(random.choices(cjk, k=random.randint(3, 40))) for _ in range(n // 10)]
+    assert list(clip_many(texts, max_len)) == [clip(text, max_len) for text in texts]
+    cases = [
+        ('clip', len(texts), lambda: [clip(text, max_len) for text in texts]),
+        ('clip_many(str)', len(texts), lambda: list(clip_many(texts, max_len))),
+        ('clip(decode)', len(texts), lambda: [clip(text.decode('utf-8'), max_len).encode('utf-8') for text in texts_bytes]),
+        ('clip_many(bytes)', len(texts), lambda: list(clip_many(texts_bytes, max_len))),
+        ('clip_file(bytes)', len(texts), lambda: clip_file(io.BytesIO(b'\n'.join(texts_bytes)), io.BytesIO(), max_len)),
+        ('clip_many(width)', len(texts_cjk), lambda: list(clip_many(texts_cjk, max_len, width=True))),
+    ]
+    for name, count, run in cases:
+        t0 = time.perf_counter()
+        run()
+        print('%-16s: %10.0f texts/s' % (name, count / (time.perf_counter() - t0)))
+# bench_clip()
+
 # 注解不会做任何处理，只是存储在函数的__annotations__属性中（一个字典）
 # 可以使用signature.return_annotation提取注解
 
@@ -120,6 +409,108 @@ from operator import mul
 def _fact(n):
     return reduce(mul, range(1, n+1))
 
+# 大数阶乘：factorial递归，n接近1000就超过递归深度；三个版本都从左到右依次连乘
+# 越乘越大的整数每次都要和一个小数相乘，总代价大致是n的平方级
+# range_product用二分乘积：先用math.prod把相邻的小数按块乘起来，再一层层两两相乘，
+# 每次相乘的两个数大小相近，能用上int乘法的Karatsuba算法；整个过程是循环，没有递归
+# factorial_fast的结果与三个版本相同（n为0时fact和_fact会报错，它返回1），可以直接替换它们
+# 算过的结果放进有界的缓存：再算更大的n时从缓存中最近的m!开始，只需再乘上m+1到n
+# factorials一次计算一批：排好序后依次用前一个结果乘上中间那一段，前缀乘积只算一遍
+import collections
+import math
+
+FACTORIAL_CACHE_SIZE = 128
+_fact_cache = collections.OrderedDict()
+_fact_keys = []
+
+def range_product(lo, hi, block=32):
+    if hi - lo <= block:
+        return math.prod(range(lo, hi))
+    level = [math.prod(range(i, min(i + block, hi))) for i in range(lo, hi, block)]
+    while len(level) > 1:
+        odd = [level[-1]] if len(level) % 2 else []
+        level = list(map(mul, level[0::2], level[1::2])) + odd
+    return level[0]
+
+def _cache_factorial(n, value):
+    if n in _fact_cache:
+        _fact_cache.move_to_end(n)
+        return
+    _fact_cache[n] = value
+    bisect.insort(_fact_keys, n)
+    if len(_fact_cache) > FACTORIAL_CACHE_SIZE:
+        old, _ = _fact_cache.popitem(last=False)
+        _fact_keys.remove(old)
+
+def factorial_fast(n):
+    if n < 2:
+        return 1
+    value = _fact_cache.get(n)
+    if value is not None:
+        _fact_cache.move_to_end(n)
+        return value
+    i = bisect.bisect_left(_fact_keys, n) - 1
+    if i >= 0:
+        m = _fact_keys[i]
+        value = _fact_cache[m] * range_product(m + 1, n + 1)
+    else:
+        value = range_product(2, n + 1)
+    _cache_factorial(n, value)
+    return value
+
+def factorials(ns):
+    ns = list(ns)
+    results = {}
+    prev, value = None, 1
+    for n in sorted(set(ns)):
+        if prev is None:
+            value = factorial_fast(n)
+        elif n >= 2:
+            value *= range_product(max(prev, 1) + 1, n + 1)
+        results[n] = value
+        prev = n
+    return [results[n] for n in ns]
+
+# C(n, k)只需要n-k+1到n这一段的乘积，再除以k!
+def binomial(n, k):
+    if not 0 <= k <= n:
+        return 0
+    k = min(k, n - k)
+    return range_product(n - k + 1, n + 1) // factorial_fast(k)
+
+if __name__ == '__main__':
+    print(factorial_fast(20) == fact(20) == _fact(20) == factorial(20), factorials([5, 3, 10]), binomial(10, 3))
+
+# n从10到10^6，比较各个版本与math.factorial的耗时
+# 递归版超过递归深度时跳过；依次连乘的两个版本在n很大时要算几分钟，超过max_sequential也跳过
+def bench_factorial(ns=(10, 100, 1000, 10**4, 10**5, 10**6), max_sequential=10**5):
+    import time
+
+    def uncached(n):
+        _fact_cache.clear()
+        del _fact_keys[:]
+        return factorial_fast(n)
+
+    variants = [('factorial', factorial), ('fact', fact), ('_fact', _fact),
+                ('factorial_fast', uncached), ('factorial_fast(memo hit)', factorial_fast),
+                ('math.factorial', math.factorial)]
+    for n in ns:
+        for name, func in variants:
+            if name in ('factorial', 'fact', '_fact') and n > max_sequential:
+                continue
+            t0 = time.perf_counter()
+            try:
+                func(n)
+            except RecursionError:
+                print('n=%-8d %-24s: RecursionError' % (n, name))
+                continue
+            print('n=%-8d %-24s: %12.3fms' % (n, name, (time.perf_counter() - t0) * 1e3))
+        batch = list(range(n // 10, n + 1, max(n // 10, 1)))
+        t0 = time.perf_counter()
+        factorials(batch)
+        print('n=%-8d %-24s: %12.3fms' % (n, 'factorials(10 values)', (time.perf_counter() - t0) * 1e3))
+# bench_factorial()
+
 # operator中有一类函数，能替代从序列中取出元素或读取对象属性的lambda表达式
 # 如itemgetter和attrgetter
 # itemgetter(1)的作用与lambda fields: fields[1]一样
@@ -127,21 +518,266 @@ def _fact(n):
 # itemgetter使用[]运算符，所以可以支持映射和任何实现__getitem__方法的类
 # attrgetter类似，如attrgetter('name', 'coord.lat')提取相应字段的值
 
-import operator
-print([name for name in dir(operator) if not name.startswith('_')])
+# 对几百万条记录按嵌套属性排序时，attrgetter('coordinates.lat')每条记录都要走一遍路径，
+# 多个排序键还要为每条记录构建一个元组，比较元组又要逐个比较元素
+# Projection把字段路径编译一次：字符串按点号拆成属性路径，其他值当作[]的键
+# 所有路径合成一棵前缀树，共享的前缀（如coordinates）只整列提取一次，下一层再从这一列里提取
+# 每一步都是map(attrgetter/itemgetter, 上一列)，全部在C层完成
+# 提取出的列如果全是float就存成array('d')，全是能装进64位的int就存成array('q')，否则保留列表
+# argsort不排序记录，只排序下标列表：从最次要的键开始，每个键用一个单独的列排一次
+# 排序时直接用提取出的列表，不转成array，免得每次取键都要重新装箱
+# list.sort是稳定的，reverse=True时相等元素也保持原来的次序，所以各键可以分别指定升序或降序
+# 每次只比较同一类型的单个值，不用构建和比较元组
+# 只有一个键时，按下标排序再按下标取回记录反而多了一步，sort直接用sorted加编译好的getter
+# reverse传布尔值时，sort的结果与sorted(records, key=attrgetter(*fields), reverse=reverse)相同
+# （字段都是属性路径时；整数字段对应itemgetter）
+# 每个顶层字段都要从记录里各取一遍，所以输入不是序列（如生成器）时先转成列表，只遍历一次
+import array
+from collections.abc import Sequence
+
+class Projection:
+    def __init__(self, *fields):
+        self.fields = fields
+        self._steps = []
+        slots = {(): 0}
+        self._outputs = []
+        for field in fields:
+            if isinstance(field, str):
+                path = tuple(('.', name) for name in field.split('.'))
+            else:
+                path = (('[]', field),)
+            for depth in range(1, len(path) + 1):
+                prefix = path[:depth]
+                if prefix not in slots:
+                    kind, name = prefix[-1]
+                    getter = operator.attrgetter(name) if kind == '.' else operator.itemgetter(name)
+                    self._steps.append((slots[path[:depth - 1]], getter))
+                    slots[prefix] = len(self._steps)
+            self._outputs.append(slots[path])
+        if len(fields) == 1:
+            field = fields[0]
+            self._key = operator.attrgetter(field) if isinstance(field, str) else operator.itemgetter(field)
+
+    def __repr__(self):
+        return 'Projection(%s)' % ', '.join(map(repr, self.fields))
+
+    @staticmethod
+    def _pack(column):
+        kinds = set(map(type, column))
+        if kinds == {float}:
+            return array.array('d', column)
+        if kinds == {int}:
+            try:
+                return array.array('q', column)
+            except OverflowError:
+                pass
+        return column
+
+    def _extract(self, records):
+        columns = [records if isinstance(records, Sequence) else list(records)]
+        for parent, getter in self._steps:
+            columns.append(list(map(getter, columns[parent])))
+        return [columns[slot] for slot in self._outputs]
+
+    def columns(self, records):
+        columns = self._extract(records)
+        packed = {}
+        for column in columns:
+            if id(column) not in packed:
+                packed[id(column)] = self._pack(column)
+        return [packed[id(column)] for column in columns]
+
+    def rows(self, records):
+        return list(zip(*self.columns(records)))
+
+    def argsort(self, records, reverse=False, columns=None):
+        if columns is None:
+            columns = self._extract(records)
+        if isinstance(reverse, bool):
+            reverse = [reverse] * len(columns)
+        elif len(reverse) != len(columns):
+            raise ValueError('expected %d sort directions, got %d' % (len(columns), len(reverse)))
+        index = list(range(len(columns[0]) if columns else len(records)))
+        for column, descending in reversed(list(zip(columns, reverse))):
+            index.sort(key=column.__getitem__, reverse=descending)
+        return index
+
+    def sort(self, records, reverse=False):
+        if len(self.fields) == 1 and isinstance(reverse, bool):
+            return sorted(records, key=self._key, reverse=reverse)
+        records = list(records)
+        return list(map(records.__getitem__, self.argsort(records, reverse)))
+
+City = collections.namedtuple('City', 'name country population coordinates')
+LatLong = collections.namedtuple('LatLong', 'lat long')
+if __name__ == '__main__':
+    metro_data = [City('Tokyo', 'JP', 36.933, LatLong(35.689722, 139.691667)),
+                  City('Delhi NCR', 'IN', 21.935, LatLong(28.613889, 77.208889)),
+                  City('Mexico City', 'MX', 20.142, LatLong(19.433333, -99.133333)),
+                  City('New York-Newark', 'US', 20.104, LatLong(40.808611, -74.020386)),
+                  City('Sao Paulo', 'BR', 19.649, LatLong(-23.547778, -46.635833))]
+    by_coord = Projection('coordinates.lat', 'coordinates.long')
+    print(by_coord, by_coord.columns(metro_data))
+    print([city.name for city in by_coord.sort(metro_data, reverse=[True, False])])
+
+# 比较sorted加attrgetter与Projection：单个嵌套键、两个嵌套键、升降序混合的三个键
+def bench_projection(n=10**6):
+    import random
+    import time
+    countries = ['JP', 'IN', 'MX', 'US', 'BR', 'CN', 'DE']
+    records = [City('city%d' % random.randrange(n), random.choice(countries), random.randrange(10**7),
+                    LatLong(round(random.uniform(-90, 90), 2), round(random.uniform(-180, 180), 2)))
+               for _ in range(n)]
+    cases = [
+        (('coordinates.lat',), False),
+        (('coordinates.lat', 'coordinates.long'), False),
+        (('country', 'population', 'name'), [False, True, False]),
+    ]
+    for fields, reverse in cases:
+        t0 = time.perf_counter()
+        if isinstance(reverse, bool):
+            expected = sorted(records, key=operator.attrgetter(*fields), reverse=reverse)
+        else:
+            expected = sorted(records, key=lambda city: (city.country, -city.population, city.name))
+        t1 = time.perf_counter()
+        result = Projection(*fields).sort(records, reverse)
+        t2 = time.perf_counter()
+        assert result == expected
+        print('%-40s: sorted %8.3fs  Projection %8.3fs' % (', '.join(fields), t1 - t0, t2 - t1))
+# bench_projection()
+
+if __name__ == '__main__':
+    print([name for name in dir(operator) if not name.startswith('_')])
 
 # i开头，后面是另一个运算符的那些名称，对应的是增量赋值运算符，如+=，&=等
 # 如果第一个参数是可变的，那么这些运算符函数会就地修改它
 
 # methodcaller创建的函数会在对象上调用参数指定的方法
 from operator import methodcaller
-s = 'The time has come'
-upcase = methodcaller('upper')
-print(upcase(s))
+if __name__ == '__main__':
+    s = 'The time has come'
+    upcase = methodcaller('upper')
+    print(upcase(s))
 
 # 使用functools.partial冻结参数
 # 这个函数用于基于一个函数创建一个新的可调用对象，把原函数的某些参数固定，使得参数更少
 from functools import partial
-triple = partial(mul, 3)
-print(triple(7))
-print(list(map(triple, range(1, 10))))
\ No newline at end of file
+if __name__ == '__main__':
+    triple = partial(mul, 3)
+    print(triple(7))
+    print(list(map(triple, range(1, 10))))
+# 把map、filter和reduce串成一条惰性的流水线：Pipeline(iterable).filter(...).map(...)每次返回新的Pipeline，
+# 只记录阶段，不做计算
+# 执行时相邻的map和filter阶段叠成一串C实现的map/filter迭代器，元素一个接一个穿过所有阶段，
+# 只遍历一遍，也不产生中间列表
+# mode='serial'在当前线程里执行；'thread'和'process'把输入按chunk_size切块，交给线程池或进程池，
+# 结果仍按输入顺序产出，同一时刻最多有2*workers个块在池中（执行循环是fluentpython._pool.map_chunks）
+# 进程池要把各阶段的函数pickle到子进程，所以只能用模块级函数、内置函数、partial、methodcaller等，不能用lambda
+# reduce要求函数满足结合律：每块先在池中各自归约成一个部分结果，
+# 部分结果再像二进制计数器那样两两合并，保持原来的左右次序，成一棵平衡的树
+# 大整数连乘这类越算越大的归约，两两合并也比从左到右依次合并快
+import os
+
+from fluentpython._pool import map_chunks
+
+PIPELINE_CHUNK = 1024
+_MISSING = object()
+
+def _apply_stages(stages, iterable):
+    iterable = iter(iterable)
+    for kind, function in stages:
+        iterable = map(function, iterable) if kind == 'map' else filter(function, iterable)
+    return iterable
+
+def _run_chunk(stages, chunk):
+    return list(_apply_stages(stages, chunk))
+
+def _reduce_chunk(stages, function, chunk):
+    it = _apply_stages(stages, chunk)
+    for first in it:
+        return [reduce(function, it, first)]
+    return []
+
+def tree_reduce(function, values, initial=_MISSING):
+    stack = []
+    for value in values:
+        level = 0
+        while stack and stack[-1][0] == level:
+            value = function(stack.pop()[1], value)
+            level += 1
+        stack.append((level, value))
+    if not stack:
+        if initial is _MISSING:
+            raise TypeError('tree_reduce() of empty iterable with no initial value')
+        return initial
+    result = stack.pop()[1]
+    while stack:
+        result = function(stack.pop()[1], result)
+    return result if initial is _MISSING else function(initial, result)
+
+class Pipeline:
+    def __init__(self, iterable, mode='serial', workers=None, chunk_size=PIPELINE_CHUNK, stages=()):
+        if mode not in ('serial', 'thread', 'process'):
+            raise ValueError("mode must be 'serial', 'thread' or 'process', not %r" % mode)
+        self.iterable = iterable
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.stages = tuple(stages)
+
+    def __repr__(self):
+        stages = ''.join('.%s(%r)' % stage for stage in self.stages)
+        return 'Pipeline(%r, mode=%r)%s' % (self.iterable, self.mode, stages)
+
+    def _then(self, kind, function):
+        return Pipeline(self.iterable, self.mode, self.workers, self.chunk_size,
+                        self.stages + ((kind, function),))
+
+    def map(self, function):
+        return self._then('map', function)
+
+    def filter(self, predicate):
+        return self._then('filter', predicate)
+
+    def _run(self, task, *args):
+        return map_chunks(partial(task, *args), self.iterable, self.chunk_size, self.workers, self.mode)
+
+    def __iter__(self):
+        if self.mode == 'serial':
+            return _apply_stages(self.stages, self.iterable)
+        return itertools.chain.from_iterable(self._run(_run_chunk, self.stages))
+
+    def reduce(self, function, initial=_MISSING):
+        partials = itertools.chain.from_iterable(self._run(_reduce_chunk, self.stages, function))
+        return tree_reduce(function, partials, initial)
+
+if __name__ == '__main__':
+    # 与map(fact, filter(lambda n: n % 2, range(6)))相同，partial(and_, 1)相当于n & 1
+    odd_facts = Pipeline(range(6)).filter(partial(operator.and_, 1)).map(fact)
+    print(odd_facts, list(odd_facts), odd_facts.reduce(operator.add))
+
+# CPU密集的阶段：取奇数，求阶乘，再求阶乘的位数，最后求和
+# 比较map/filter/reduce直接串起来的写法与各种模式、不同进程数的Pipeline
+def bench_pipeline(n=3000, start=1000, workers=(1, 2, 4), chunk_size=64):
+    import time
+    is_odd = partial(operator.and_, 1)
+    bit_length = methodcaller('bit_length')
+    source = range(start, start + n)
+    cases = [
+        ('map/filter/reduce', lambda: reduce(operator.add, map(bit_length, map(_fact, filter(is_odd, source))))),
+        ('Pipeline(serial)', lambda: Pipeline(source, chunk_size=chunk_size)
+            .filter(is_odd).map(_fact).map(bit_length).reduce(operator.add)),
+        ('Pipeline(thread, %d)' % max(workers), lambda: Pipeline(source, 'thread', max(workers), chunk_size)
+            .filter(is_odd).map(_fact).map(bit_length).reduce(operator.add)),
+    ]
+    cases += [('Pipeline(process, %d)' % w, lambda w=w: Pipeline(source, 'process', w, chunk_size)
+                .filter(is_odd).map(_fact).map(bit_length).reduce(operator.add))
+              for w in workers]
+    expected = None
+    for name, run in cases:
+        t0 = time.perf_counter()
+        result = run()
+        print('%-24s: %8.3fs' % (name, time.perf_counter() - t0))
+        assert expected is None or result == expected
+        expected = result
+# bench_pipeline()
@@ -0,0 +1,35 @@
+# 笔记各章中可以复用的函数和类，统一从这里导入，如from fluentpython import grade, shave_marks, tag, clip
+# 导入本包时不会导入任何一章：第一次访问某个名字时，模块级的__getattr__（PEP 562）才导入它所在的章节，
+# 并把取到的对象存进包的全局变量，之后的访问不再经过__getattr__
+# 各章的示例都放在if __name__ == '__main__'下，只有直接运行（python chapter4.py或python -m fluentpython demo 4）才执行
+# pyuca、unicodedata、inspect、concurrent.futures等较重的依赖都推迟到第一次调用用到它们的函数时才导入
+import importlib
+
+_EXPORTS = {
+    'chapter2': ('LazyProduct', 'City', 'LatLong', 'CityTable', 'CityRow', 'grade', 'grade_many',
+                 'grade_codes_to_str', 'SortedList', 'FloatStore', 'PackedRecords', 'RingBuffer'),
+    'chapter3': ('StrKeyDict0', 'LayerDict', 'CachedChainMap', 'sharded_count', 'SpaceSaving', 'StrKeyDict',
+                 'FastStrKeyDict', 'PersistentMap', 'SnapshotDict', 'RoaringSet', 'CompactHashMap'),
+    'chapter4': ('detect_bom', 'counting_errors', 'TranscodeStats', 'transcode_stream', 'transcode_file',
+                 'EncodingGuess', 'sniff_encoding', 'sniff_file', 'shave_marks', 'shave_marks_latin', 'fold_table',
+                 'fold_text', 'fold_lines', 'load_collator', 'weights_to_bytes', 'pyuca_backend', 'locale_backend',
+                 'make_sort_key', 'collate_sort', 'PatternScanner'),
+    'chapter5': ('factorial', 'fact', '_fact', 'tag', 'render_tag', 'render_many', 'compile_binder', 'Dispatcher',
+                 'clip', 'char_width', 'clip_width', 'clip_many', 'clip_file', 'range_product', 'factorial_fast',
+                 'factorials', 'binomial', 'Projection', 'tree_reduce', 'Pipeline'),
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+def __getattr__(name):
+    try:
+        module = _MODULES[name]
+    except KeyError:
+        raise AttributeError('module %r has no attribute %r' % (__name__, name)) from None
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,72 @@
+# 显式入口
+# python -m fluentpython demo [2 3 ...]：运行各章的示例，等同于依次执行python chapterN.py，不给章节号就运行全部
+# python -m fluentpython importtime [--budget-ms 30] [--repeat 5]：导入时间基准，可以在CI中拦截回归
+#   在子进程里用python -X importtime分别导入本包和各章，每个模块先导入一次写出.pyc，再取repeat次中的最小值
+#   某个模块的累计导入时间超过预算，或者导入时加载了HEAVY_MODULES中的模块，就以状态1退出
+import argparse
+import os
+import runpy
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHAPTERS = ('chapter2', 'chapter3', 'chapter4', 'chapter5')
+HEAVY_MODULES = ('pyuca', 'unicodedata', 'inspect', 'numpy', 'chardet', 'concurrent.futures', 'html', 're',
+                 'random', 'tempfile', 'pickle', 'locale', 'shutil')
+
+def run_demos(chapters):
+    for chapter in chapters:
+        print('=' * 20, chapter, '=' * 20)
+        runpy.run_path(os.path.join(ROOT, chapter + '.py'), run_name='__main__')
+
+def _parse_importtime(stderr):
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if cumulative_us.strip().isdigit():
+            cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+def import_time(module, repeat=5):
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import %s' % module]
+    best = None
+    for _ in range(repeat + 1):
+        proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        cumulative = _parse_importtime(proc.stderr)
+        if best is None or cumulative[module] < best[0]:
+            best = cumulative[module], cumulative
+    return best[0], sorted(name for name in best[1] if name in HEAVY_MODULES)
+
+def bench_import(modules=('fluentpython',) + CHAPTERS, budget_ms=30.0, repeat=5):
+    ok = True
+    for module in modules:
+        elapsed_us, heavy = import_time(module, repeat)
+        failed = elapsed_us > budget_ms * 1e3 or heavy
+        ok = ok and not failed
+        print('%-14s: %8.2fms%s%s' % (module, elapsed_us / 1e3, '  heavy: ' + ', '.join(heavy) if heavy else '',
+                                      '  FAIL' if failed else ''))
+    return ok
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m fluentpython')
+    commands = parser.add_subparsers(dest='command', required=True)
+    demo = commands.add_parser('demo', help='run the demos of the given chapters')
+    demo.add_argument('chapters', nargs='*', type=int)
+    importtime = commands.add_parser('importtime', help='check the import time of the package and each chapter')
+    importtime.add_argument('--budget-ms', type=float, default=30.0)
+    importtime.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.command == 'demo':
+        unknown = [n for n in args.chapters if 'chapter%d' % n not in CHAPTERS]
+        if unknown:
+            parser.error('no such chapter: %s' % ', '.join(map(str, unknown)))
+        run_demos(['chapter%d' % n for n in args.chapters] or CHAPTERS)
+        return 0
+    return 0 if bench_import(budget_ms=args.budget_ms, repeat=args.repeat) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
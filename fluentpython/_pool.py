@@ -0,0 +1,28 @@
+# 各章按块并行处理时共用的执行循环（chapter3的sharded_count、chapter4的fold_lines、chapter5的Pipeline）
+# map_chunks把输入按chunk_size切块，对每块调用function，按输入顺序逐个产出每块的结果
+# mode为'serial'时在当前线程中依次计算；'thread'和'process'分别用线程池和进程池，进程池要求function和块都能pickle
+# 同一时刻最多只有2*workers个块在池中：最早提交的块算完取走之后才继续切下一块，内存占用与输入长度无关
+# concurrent.futures只在真正用到池时才导入
+import collections
+import itertools
+import os
+
+def chunks(iterable, chunk_size):
+    it = iter(iterable)
+    return iter(lambda: list(itertools.islice(it, chunk_size)), [])
+
+def map_chunks(function, iterable, chunk_size, workers=None, mode='process'):
+    if mode == 'serial':
+        yield from map(function, chunks(iterable, chunk_size))
+        return
+    from concurrent import futures
+    workers = workers or os.cpu_count() or 1
+    pool = futures.ThreadPoolExecutor if mode == 'thread' else futures.ProcessPoolExecutor
+    with pool(workers) as executor:
+        pending = collections.deque()
+        for chunk in chunks(iterable, chunk_size):
+            pending.append(executor.submit(function, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()